@@ -6,10 +6,11 @@ parse command line
 read in corpus
 """
 from __future__ import absolute_import
-import sys,codecs,time,string
+import sys,os,codecs,time,string
 #from optparse import OptionParser
 import re
 import random
+import itertools
 import cPickle as pickle
 from common.SpanGraph import *
 from common.AMRGraph import *
@@ -60,27 +61,40 @@ def get_dependency_graph(stp_dep,FROMFILE=False):
 
     return dpg_list
 
+def _write_amr(output,pamr,inst,hand_alignments=None):
+    if inst.comment:
+        output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['id','date','snt-type','annotator'])))
+        output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['snt','tok'])))
+        if hand_alignments:
+            output.write('# ::alignments %s ::gold\n' % (hand_alignments[inst.comment['id']]))
+        #output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['alignments'])))
+    else:
+        output.write('# ::id %s\n'%(inst.sentID))
+        output.write('# ::snt %s\n'%(inst.text))
+
+    try:
+        output.write(pamr.to_amr_string())
+    except TypeError:
+        import pdb
+        pdb.set_trace()
+    output.write('\n\n')
+
 def write_parsed_amr(parsed_amr,instances,amr_file,suffix='parsed',hand_alignments=None):
     output = open(amr_file+'.'+suffix,'w')
     for pamr,inst in zip(parsed_amr,instances):
-        if inst.comment:
-            output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['id','date','snt-type','annotator'])))
-            output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['snt','tok'])))
-            if hand_alignments:
-                output.write('# ::alignments %s ::gold\n' % (hand_alignments[inst.comment['id']]))
-            #output.write('# %s\n' % (' '.join(('::%s %s')%(k,v) for k,v in inst.comment.items() if k in ['alignments'])))
-        else:
-            output.write('# ::id %s\n'%(inst.sentID))
-            output.write('# ::snt %s\n'%(inst.text))
-
-        try:
-            output.write(pamr.to_amr_string())
-        except TypeError:
-            import pdb
-            pdb.set_trace()
-        output.write('\n\n')
+        _write_amr(output,pamr,inst,hand_alignments)
     output.close()
 
+def write_parsed_amr_stream(parsed_pairs,amr_file,suffix='parsed'):
+    '''write (instance, parsed AMR) pairs as they come, flushing after each AMR'''
+    output = open(amr_file+'.'+suffix,'w')
+    try:
+        for inst,pamr in parsed_pairs:
+            _write_amr(output,pamr,inst)
+            output.flush()
+    finally:
+        output.close()
+
 def write_span_graph(span_graph_pairs,instances,amr_file,suffix='spg'):
     output_d = open(amr_file+'.'+suffix+'.dep', 'w')
     output_p = open(amr_file+'.'+suffix+'.parsed','w')
@@ -134,7 +148,7 @@ def main():
     arg_parser.add_argument('-d','--dev',help='development file')
     arg_parser.add_argument('-a','--add',help='additional training file')
     arg_parser.add_argument('-as','--actionset',choices=['basic'],default='basic',help='choose different action set')
-    arg_parser.add_argument('-m','--mode',choices=['preprocess','test_gold_graph','align','userGuide','oracleGuide','train','parse','eval'],help="preprocess:generate pos tag, dependency tree, ner\n" "align:do alignment between AMR graph and sentence string")
+    arg_parser.add_argument('-m','--mode',choices=['preprocess','test_gold_graph','align','userGuide','oracleGuide','train','parse','convert','prune','eval'],help="preprocess:generate pos tag, dependency tree, ner\n" "align:do alignment between AMR graph and sentence string")
     arg_parser.add_argument('-dp','--depparser',choices=['stanford','stanfordConvert','stdconv+charniak','clear','mate','turbo'],default='stdconv+charniak',help='choose the dependency parser')
     arg_parser.add_argument('--coref',action='store_true',help='flag to enable coreference information')
     arg_parser.add_argument('--prop',action='store_true',help='flag to enable semantic role labeling information')
@@ -143,8 +157,15 @@ def main():
     #arg_parser.add_argument('--onto',action='store_true',help='flag to enable charniak parse result trained on ontonotes')
     arg_parser.add_argument('--onto',choices=['onto','onto+bolt','wsj'],default='wsj',help='choose which charniak parse result trained on ontonotes')
     arg_parser.add_argument('--model',help='specify the model file')
+    arg_parser.add_argument('--mmap',action='store_true',help='save the trained model as a directory of memory-mapped arrays')
     arg_parser.add_argument('--feat',help='feature template file')
+    arg_parser.add_argument('--prune_threshold',default=1e-3,type=float,help='prune mode: drop feature rows whose averaged weight norm is under this, and the templates left without rows')
+    arg_parser.add_argument('--hashbits',type=int,help='use the hashing trick with 2^HASHBITS weight rows per action class instead of a feature dictionary')
     arg_parser.add_argument('-iter','--iterations',default=1,type=int,help='training iterations')
+    arg_parser.add_argument('--workers',default=1,type=int,help='number of worker processes for parsing')
+    arg_parser.add_argument('--profile_feats',action='store_true',help='parse mode: time and count every feature template and print a table after parsing; profiles one process, implies --workers 1')
+    arg_parser.add_argument('--no_oracle_trace',action='store_true',help='train mode: run the oracle on every iteration instead of replaying the gold actions cached in <amr_file>.oracle')
+    arg_parser.add_argument('--stream',action='store_true',help='parse mode: read, parse and write the sentences one at a time instead of loading the whole input')
     arg_parser.add_argument('amr_file',nargs='?',help='amr annotation file/input sentence file for parsing')
     arg_parser.add_argument('--prpfmt',choices=['xml','plain'],default='plain',help='preprocessed file format')
     arg_parser.add_argument('--amrfmt',choices=['sent','amr','amreval'],default='sent',help='specifying the input file format')
@@ -174,8 +195,7 @@ def main():
         #instances = pickle.load(open('data/gold_edge_graph.pkl','rb'))
         gold_amr = []
         for inst in instances:
-            GraphState.sent = inst.tokens
-            gold_amr.append(GraphState.get_parsed_amr(inst.gold_graph))
+            gold_amr.append(GraphState.get_parsed_amr(inst.gold_graph,inst.tokens))
         #pseudo_gold_amr = [GraphState.get_parsed_amr(inst.gold_graph) for inst in instances]
         write_parsed_amr(gold_amr,instances,amr_file,'abt.gold')
         #instances = preprocess_aligned(amr_file)
@@ -294,7 +314,7 @@ def main():
             instance.comment['alignments'] += ''.join(' %s-%s|%s'%(idx-1,idx,instance.amr.get_pid(state.A.abt_node_table[idx])) for idx in state.A.abt_node_table if isinstance(idx,int))
 
             aligned_instances.append(instance)
-            pseudo_gold_amr.append(GraphState.get_parsed_amr(state.A))
+            pseudo_gold_amr.append(GraphState.get_parsed_amr(state.A,state.ctx.sent))
             #gold_amr.append(instance.amr)
             #assert set(state.A.tuples()) == set(instance.gold_graph.tuples())
         pt = n_correct_total/n_parsed_total if n_parsed_total != .0 else .0
@@ -334,7 +354,9 @@ def main():
         model = Model(elog=experiment_log)
         #model.output_feature_generator()
         parser = Parser(model=model,oracle_type=DET_T2G_ORACLE_ABT,action_type=args.actionset,verbose=args.verbose,elog=experiment_log)
-        model.setup(action_type=args.actionset,instances=train_instances,parser=parser,feature_templates_file=feat_template)
+        model.setup(action_type=args.actionset,instances=train_instances,parser=parser,feature_templates_file=feat_template,feature_hash_bits=args.hashbits)
+        if not args.no_oracle_trace:
+            parser.load_oracle_traces(train_instances,amr_file+'.oracle')
         
         print >> experiment_log, "BEGIN TRAINING!"
         best_fscore = 0.0
@@ -379,24 +401,36 @@ def main():
 
         if best_model is not None:
             print >> experiment_log, "Best result on iteration %d:\n Precision: %f\n Recall: %f\n F-score: %f" % (best_iter, best_pscore, best_rscore, best_fscore)
-            best_model.save_model(args.model+'.m')
+            if args.mmap:
+                best_model.save_model_dir(args.model+'.mdir')
+            else:
+                best_model.save_model(args.model+'.m')
         print >> experiment_log ,"DONE TRAINING!"
         
     elif args.mode == 'parse': # actual parsing
-        test_instances = preprocess(amr_file,START_SNLP=False,INPUT_AMR=args.amrfmt,PRP_FORMAT=args.prpfmt)
+        if args.stream:
+            test_instances = preprocess_iter(amr_file,START_SNLP=False,INPUT_AMR=args.amrfmt,PRP_FORMAT=args.prpfmt)
+        else:
+            test_instances = preprocess(amr_file,START_SNLP=False,INPUT_AMR=args.amrfmt,PRP_FORMAT=args.prpfmt)
         if args.section != 'all':
             print "Choosing corpus section: %s"%(args.section)
             tcr = constants.get_corpus_range(args.section,'test')
-            test_instances = test_instances[tcr[0]:tcr[1]]
+            test_instances = itertools.islice(test_instances,tcr[0],tcr[1]) if args.stream else test_instances[tcr[0]:tcr[1]]
             
         #random.shuffle(test_instances)
         print >> experiment_log, "Loading model: ", args.model 
         model = Model.load_model(args.model)
+        if args.profile_feats:
+            model.profile_features()
+            args.workers = 1
         parser = Parser(model=model,oracle_type=DET_T2G_ORACLE_ABT,action_type=args.actionset,verbose=args.verbose,elog=experiment_log)
         print >> experiment_log ,"BEGIN PARSING"
-        span_graph_pairs,results = parser.parse_corpus_test(test_instances)
         parsed_suffix = '%s.%s.parsed'%(args.section,args.model.split('.')[-2])
-        write_parsed_amr(results,test_instances,amr_file,suffix=parsed_suffix)
+        if args.stream:
+            write_parsed_amr_stream(parser.parse_corpus_iter(test_instances,workers=args.workers),amr_file,suffix=parsed_suffix)
+        else:
+            span_graph_pairs,results = parser.parse_corpus_test(test_instances,workers=args.workers)
+            write_parsed_amr(results,test_instances,amr_file,suffix=parsed_suffix)
         #write_span_graph(span_graph_pairs,test_instances,amr_file,suffix='spg.50')
         ################
         # for eval     #
@@ -418,6 +452,23 @@ def main():
         #plt.hist(results)
         #plt.savefig('result.png')
 
+    elif args.mode == 'convert': # pickled model to memory-mapped model directory
+        print >> experiment_log, "Loading model: ", args.model 
+        model = Model.load_model(args.model)
+        model_dir = os.path.splitext(args.model)[0]+'.mdir'
+        model.save_model_dir(model_dir)
+        print >> experiment_log, "Model saved to: ", model_dir
+
+    elif args.mode == 'prune': # drop near zero feature rows and templates from a pickled model
+        print >> experiment_log, "Loading model: ", args.model 
+        model = Model.load_model(args.model)
+        kept_templates = model.prune(args.prune_threshold)
+        if kept_templates is not None:
+            pruned_name = os.path.splitext(args.model)[0]+'-pruned'
+            model.output_templates(pruned_name+'.templates',set(kept_templates))
+            model.save_model(pruned_name+'.m')
+            print >> experiment_log, "Model saved to: %s.m, templates to: %s.templates" % (pruned_name,pruned_name)
+
     elif args.mode == 'eval':
         '''break down error analysis'''
         # TODO: here use pickled file, replace it with parsed AMR and gold AMR
@@ -14,15 +14,72 @@ from collections import defaultdict
 log=sys.stderr
 debuglevel=1
 
+class OrderedSet(list):
+    """
+    children or parents of a SpanNode: a list in insertion order, as before,
+    with set membership and a sorted view cached until the next change
+    """
+    __slots__ = ('_members','_sorted','_positions')
+
+    def __init__(self,items=()):
+        list.__init__(self)
+        self._members = set()
+        self._sorted = None
+        self._positions = None
+        for x in items:
+            self.add(x)
+
+    def __reduce__(self):
+        return (OrderedSet,(list(self),))
+
+    def copy(self):
+        other = OrderedSet.__new__(OrderedSet)
+        list.extend(other,self)
+        other._members = self._members.copy()
+        other._sorted = self._sorted
+        other._positions = self._positions
+        return other
+
+    def __contains__(self,x):
+        return x in self._members
+
+    def add(self,x):
+        if x not in self._members:
+            list.append(self,x)
+            self._members.add(x)
+            self._sorted = self._positions = None
+
+    append = add
+
+    def remove(self,x):
+        list.remove(self,x)
+        self._members.discard(x)
+        self._sorted = self._positions = None
+
+    def sorted(self):
+        """sorted tuple of the items, shared until the set changes"""
+        if self._sorted is None:
+            self._sorted = tuple(sorted(self))
+        return self._sorted
+
+    def position(self,x):
+        """index of x in sorted(), like sorted().index(x) without the sort and the scan"""
+        if self._positions is None:
+            self._positions = dict((y,i) for i,y in enumerate(self.sorted()))
+        return self._positions[x]
+
 class SpanNode(object):
+    __slots__ = ('start','end','tag','words','children','parents','SWAPPED','num_swap',
+                 'num_parent_infer','num_parent_infer_in_chain','del_child','rep_parent',
+                 'outgoing_traces','incoming_traces')
 
     def __init__(self,start,end,words,tag=constants.NULL_TAG):
         self.start = start
         self.end = end
         self.tag = tag
         self.words = words
-        self.children = []
-        self.parents = [] 
+        self.children = OrderedSet()
+        self.parents = OrderedSet()
         self.SWAPPED = False
         self.num_swap = 0
         self.num_parent_infer = 0
@@ -32,17 +89,40 @@ class SpanNode(object):
         self.outgoing_traces = set()
         self.incoming_traces = set()
 
+    def __getstate__(self):
+        return dict((k,getattr(self,k)) for k in SpanNode.__slots__ if hasattr(self,k))
+
+    def __setstate__(self,state):
+        for k,v in state.items():
+            setattr(self,k,v)
+        if not isinstance(self.children,OrderedSet): # nodes pickled with plain lists
+            self.children = OrderedSet(self.children)
+            self.parents = OrderedSet(self.parents)
+
     @staticmethod
     def from_span(span):
         """initialize from span object"""
         return SpanNode(span.start,span.end,span.words,span.entity_tag)
 
+    def pcopy(self):
+        """shallow clone with its own mutable containers, used by copy-on-write graphs"""
+        node = SpanNode.__new__(SpanNode)
+        for k in SpanNode.__slots__:
+            setattr(node,k,getattr(self,k))
+        node.children = self.children.copy()
+        node.parents = self.parents.copy()
+        node.words = self.words[:]
+        node.del_child = self.del_child[:]
+        node.rep_parent = self.rep_parent[:]
+        node.outgoing_traces = self.outgoing_traces.copy()
+        node.incoming_traces = self.incoming_traces.copy()
+        return node
+
     def addChild(self,child):
         #if isinstance(c,list):
         #    self.children.extend(c)
         #else:
-        if child not in self.children:
-            self.children.append(child)
+        self.children.add(child)
 
     def contains(self,other_node):
         if other_node.start >= self.start and other_node.end <= self.end and \
@@ -52,8 +132,7 @@ class SpanNode(object):
             return False
 
     def addParent(self,parent):
-        if parent not in self.parents:
-            self.parents.append(parent)
+        self.parents.add(parent)
 
     def removeChild(self,child):
         self.children.remove(child)
@@ -85,6 +164,46 @@ class SpanGraph(object):
 
         self.nodes_error_table = defaultdict(str)
         self.edges_error_table = defaultdict(str)
+        self._owned = set() # nodes private to this graph; others are shared with its copies
+        self._path_cache = None # (root paths, node pair paths), see cache_paths
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if '_owned' not in state: # graphs pickled before copy-on-write
+            self._owned = set()
+        if '_path_cache' not in state:
+            self._path_cache = None
+
+    def pcopy(self):
+        """
+        copy-on-write copy: the containers are copied but the nodes are shared
+        until either graph modifies them
+        """
+        graph = SpanGraph.__new__(SpanGraph)
+        graph.__dict__.update(self.__dict__)
+        # node order drives get_multi_roots etc., so re-insert one by one to
+        # iterate exactly like the pickled copies did
+        graph.nodes = {}
+        for k in self.nodes: graph.nodes[k] = self.nodes[k]
+        graph.edges = self.edges.copy()
+        graph.multi_roots = self.multi_roots[:]
+        graph.static_tuples = self.static_tuples.copy()
+        graph.abt_node_table = {}
+        for k in self.abt_node_table: graph.abt_node_table[k] = self.abt_node_table[k]
+        graph.nodes_error_table = self.nodes_error_table.copy()
+        graph.edges_error_table = self.edges_error_table.copy()
+        graph._owned = set()
+        graph._path_cache = None
+        self._owned = set()
+        return graph
+
+    def _mutable_node(self,idx):
+        """get node idx for modification, cloning it first if it is shared"""
+        if idx not in self._owned:
+            self.nodes[idx] = self.nodes[idx].pcopy()
+            self._owned.add(idx)
+        return self.nodes[idx]
+
     @staticmethod
     def init_ref_graph(amr,alignment,sent=None):
         """Instantiate graph from AMR graph and alignment"""
@@ -383,10 +502,10 @@ class SpanGraph(object):
     def add_trace_info(self,instance):
         # adding trace info
         for node_id in instance.trace_dict:
-            node = self.nodes[node_id]
+            node = self._mutable_node(node_id)
             node.outgoing_traces = node.outgoing_traces.union(instance.trace_dict[node_id])
             for rel,trace_id in instance.trace_dict[node_id]:
-                trace_node = self.nodes[trace_id]
+                trace_node = self._mutable_node(trace_id)
                 trace_node.incoming_traces.add((rel,node_id))
 
     def add_coref_info(self,instance):
@@ -395,8 +514,8 @@ class SpanGraph(object):
                 src_word, src_i, src_pos, src_l, src_r = cpair[0]
                 sink_work, sink_i, sink_pos, sink_l, sink_r = cpair[1]
                 assert src_i == sink_i
-                src_node = self.nodes[src_pos]
-                sink_node = self.nodes[sink_pos]
+                src_node = self._mutable_node(src_pos)
+                sink_node = self._mutable_node(sink_pos)
                 src_head = self.sent[src_pos]['head']
                 sink_head = self.sent[sink_pos]['head']
                 src_rel = self.sent[src_pos]['rel']
@@ -492,14 +611,15 @@ class SpanGraph(object):
 
     def add_node(self,node):
         self.nodes[node.start] = node
+        self._owned.add(node.start)
 
     def add_edge(self,gov_index,dep_index,edge=constants.NULL_EDGE):
-        self.nodes[gov_index].addChild(dep_index)
-        self.nodes[dep_index].addParent(gov_index)
+        self._mutable_node(gov_index).addChild(dep_index)
+        self._mutable_node(dep_index).addParent(gov_index)
         self.edges[tuple((gov_index,dep_index))] = edge
 
     def new_abt_node(self,gov_index,tag):
-        gov_node = self.nodes[gov_index]
+        gov_node = self._mutable_node(gov_index)
         abt_node_index = constants.ABT_PREFIX+str(self.abt_node_num)
         abt_node = SpanNode(abt_node_index,abt_node_index,[constants.ABT_FORM],tag)
         self.add_node(abt_node)
@@ -534,7 +654,7 @@ class SpanGraph(object):
         self.abt_node_table[key] = value
 
     def set_node_tag(self,idx,tag):
-        self.nodes[idx].tag = tag
+        self._mutable_node(idx).tag = tag
     
     def get_node_tag(self,idx):
         return self.nodes[idx].tag 
@@ -545,6 +665,10 @@ class SpanGraph(object):
     def set_edge_label(self,gov_index,dep_index,edge_label):
         self.edges[tuple((gov_index,dep_index))] = edge_label
 
+    def child_position(self,gov_index,dep_index):
+        """rank of dep_index among the children of gov_index, cached until an edge of gov_index changes"""
+        return self.nodes[gov_index].children.position(dep_index)
+
     def get_direction(self,i,j):
         """left or right or no arc"""
         if j in self.nodes[i].children:
@@ -555,21 +679,22 @@ class SpanGraph(object):
             return -1
     
     def record_rep_head(self,cidx,idx):
-        self.nodes[cidx].rep_parent.append(idx)
+        self._mutable_node(cidx).rep_parent.append(idx)
 
     def remove_node(self,idx,RECORD=False):
         for p in self.nodes[idx].parents[:]:
             self.remove_edge(p,idx)
-            if RECORD: self.nodes[p].del_child.append(idx)
+            if RECORD: self._mutable_node(p).del_child.append(idx)
         for c in self.nodes[idx].children[:]:
             self.remove_edge(idx,c)
         del self.nodes[idx]
+        self._owned.discard(idx)
         if idx in self.multi_roots: self.multi_roots.remove(idx)
         
     # ignore the multiedge between same nodes 
     def remove_edge(self,gov_index,dep_index):
-        self.nodes[gov_index].removeChild(dep_index)
-        self.nodes[dep_index].removeParent(gov_index)
+        self._mutable_node(gov_index).removeChild(dep_index)
+        self._mutable_node(dep_index).removeParent(gov_index)
         if (gov_index,dep_index) in self.edges:
             del self.edges[(gov_index,dep_index)]
 
@@ -624,7 +749,7 @@ class SpanGraph(object):
                 self.remove_edge(dep_index,sc)
                 self.add_edge(gov_index,sc,edge_label)
         
-        self.nodes[gov_index].SWAPPED = True
+        self._mutable_node(gov_index).SWAPPED = True
             
     def reattach_node(self,idx,cidx,parent_to_attach,edge_label):
         self.remove_edge(idx,cidx)
@@ -686,8 +811,8 @@ class SpanGraph(object):
             #self.nodes[dep_index].addChild(gov_index)
             self.remove_edge(origin_index,dep_index)
             self.add_edge(dep_index,gov_index,edge_label)
-            self.nodes[gov_index].SWAPPED = True
-            self.nodes[dep_index].num_swap += 1
+            self._mutable_node(gov_index).SWAPPED = True
+            self._mutable_node(dep_index).num_swap += 1
         
     def replace_head(self,idx1,idx2):
         for c in self.nodes[idx1].children[:]:
@@ -715,8 +840,9 @@ class SpanGraph(object):
         tmp2 = idx2
         idx1 = tmp1 if tmp1 < tmp2 else tmp2
         idx2 = tmp2 if tmp1 < tmp2 else tmp1
-        self.nodes[idx1].end = self.nodes[idx2].end if self.nodes[idx1].end < self.nodes[idx2].end else self.nodes[idx1].end
-        self.nodes[idx1].words.extend(self.nodes[idx2].words)
+        node1 = self._mutable_node(idx1)
+        node1.end = self.nodes[idx2].end if node1.end < self.nodes[idx2].end else node1.end
+        node1.words.extend(self.nodes[idx2].words)
         #self.nodes[idx1].parents.extend([p1 for p1 in self.nodes[idx2].parents if p1 not in self.nodes[idx1].parents])
         for p in self.nodes[idx2].parents[:]:
             #self.nodes[p].children.remove(idx2)
@@ -732,8 +858,9 @@ class SpanGraph(object):
                 edge_label = self.get_edge_label(idx2,c)
                 self.add_edge(idx1,c,edge_label)
 
-        self.nodes[idx1].SWAPPED = False
-        self.nodes[idx1].incoming_traces = self.nodes[idx1].incoming_traces | self.nodes[idx2].incoming_traces
+        node1 = self._mutable_node(idx1)
+        node1.SWAPPED = False
+        node1.incoming_traces = node1.incoming_traces | self.nodes[idx2].incoming_traces
         self.remove_node(idx2)
 
     
@@ -750,6 +877,7 @@ class SpanGraph(object):
         from collections import deque
         visited_nodes = set()
         dep_tuples = []
+        dep_tuple_set = set() # membership for dep_tuples, which keeps the order
 
         queue = deque([root])
         while queue:
@@ -757,11 +885,12 @@ class SpanGraph(object):
             if next in visited_nodes:
                 continue
             visited_nodes.add(next)
-            for child in sorted(self.nodes[next].children):
-                if not (next,child) in dep_tuples:
+            for child in self.nodes[next].children.sorted():
+                if not (next,child) in dep_tuple_set:
                     if not child in visited_nodes:
                         queue.append(child)
                     dep_tuples.append((next,child))
+                    dep_tuple_set.add((next,child))
         return visited_nodes,dep_tuples
 
 
@@ -787,12 +916,18 @@ class SpanGraph(object):
     def tuples(self):
         """traverse the graph in index increasing order"""
         graph_tuples = []
+        graph_tuple_set = set()
         node_set = set()
         for n in sorted(self.nodes.keys()):
             if (self.nodes[n].parents == [] or n not in node_set) and self.nodes[n].children != []:  # root   
                 visited_nodes,sub_tuples = self.bfs(n,True)
-                graph_tuples.extend([st for st in sub_tuples if st not in graph_tuples])
+                for st in sub_tuples:
+                    if st not in graph_tuple_set:
+                        graph_tuples.append(st)
+                        graph_tuple_set.add(st)
                 node_set.update(visited_nodes)
+                if len(graph_tuple_set) == len(self.edges): # every edge is out already
+                    break
         return graph_tuples
 
     def postorder(self,root=0,seq=None):
@@ -826,8 +961,35 @@ class SpanGraph(object):
         assert idx in candidates
         return (candidates.index(idx),depth)
         
+    def cache_paths(self):
+        """
+        memoize path and get_path; only for a tree that doesn't change any more,
+        like the dependency tree of the sentence being parsed
+        """
+        self._path_cache = ({},{})
+
+    def _root_path(self,idx):
+        """cached path from root as a tuple, built on the cached path of the nearest ancestor"""
+        root_paths = self._path_cache[0]
+        if idx in root_paths:
+            return root_paths[idx]
+        chain = [idx]
+        cur = self.nodes[idx]
+        while cur.parents and cur.parents[0] not in root_paths:
+            cur = self.nodes[cur.parents[0]]
+            if cur.start in chain:
+                raise ValueError('cycle in tree at node %s' % cur.start)
+            chain.append(cur.start)
+        path = root_paths[cur.parents[0]] if cur.parents else ()
+        for i in reversed(chain):
+            path = path + (i,)
+            root_paths[i] = path
+        return path
+
     def path(self,idx):
         """path from root, only for tree structure"""
+        if self._path_cache is not None:
+            return list(self._root_path(idx))
         path = []
         cur = self.nodes[idx]
         path.insert(0,idx)
@@ -841,9 +1003,20 @@ class SpanGraph(object):
         return path
         
     def get_path(self,idx1,idx2):
-        """path between two nodes, only for tree structure"""
-        path1 = self.path(idx1)
-        path2 = self.path(idx2)
+        """
+        path between two nodes, only for tree structure.
+        with cache_paths the result is shared between callers, don't modify it
+        """
+        if self._path_cache is not None:
+            pair_paths = self._path_cache[1]
+            if (idx1,idx2) not in pair_paths:
+                pair_paths[idx1,idx2] = SpanGraph._join_paths(self._root_path(idx1),self._root_path(idx2))
+            return pair_paths[idx1,idx2]
+        return SpanGraph._join_paths(self.path(idx1),self.path(idx2))
+
+    @staticmethod
+    def _join_paths(path1,path2):
+        """path between the ends of two root paths through their lowest common ancestor"""
         direction = '01'
         lenth = len(path1) if len(path1) < len(path2) else len(path2)
         for i in range(lenth):
@@ -854,10 +1027,10 @@ class SpanGraph(object):
                 path = list(reversed(path1[i:]))
                 direction = '0' 
             else:
-                path = path2[i:]
+                path = list(path2[i:])
                 direction = '1'
         else:
-            path = list(reversed(path1[i-1:]))+path2[i:]
+            path = list(reversed(path1[i-1:]))+list(path2[i:])
 
         return path,direction
         
@@ -932,6 +1105,10 @@ class SpanGraph(object):
                 candidate_parents.add(otherIdx)
         return candidate_parents
 
+    def is_possible_parent_unconstrained(self,currentIdx,currentChildIdx,otherIdx):
+        """otherIdx in get_possible_parent_unconstrained(currentIdx,currentChildIdx), without building the set"""
+        return otherIdx in self.nodes and otherIdx != currentChildIdx and \
+            otherIdx not in self.nodes[currentChildIdx].parents
 
     def get_possible_reentrance_constrained(self,currentIdx,currentChildIdx):
         '''adding siblings, mainly for control verb'''
@@ -961,8 +1138,8 @@ class SpanGraph(object):
         '''promotion: only add ancestors 2 levels up the current node'''
         cur_p = self.nodes[currentIdx]
         cur = self.nodes[currentChildIdx]
-        children = sorted(self.nodes[currentIdx].children)
-        c = children.index(currentChildIdx)
+        children = self.nodes[currentIdx].children.sorted()
+        c = self.child_position(currentIdx,currentChildIdx)
         candidate_parents= set([])
         visited = set([])
         
@@ -973,7 +1150,7 @@ class SpanGraph(object):
             candidate_parents.add(children[c-1])
             visited.add(children[c-1])
             while left_sp.children:
-                ls_r_child = sorted(left_sp.children)[-1]                
+                ls_r_child = left_sp.children.sorted()[-1]                
                 if ls_r_child in visited: break
                 visited.add(ls_r_child)
                 if ls_r_child != currentChildIdx and ls_r_child not in self.nodes[currentChildIdx].children and ls_r_child not in self.nodes[currentChildIdx].parents:
@@ -985,7 +1162,7 @@ class SpanGraph(object):
             candidate_parents.add(children[c+1])
             visited.add(children[c+1])
             while right_sp.children:
-                rs_l_child = sorted(right_sp.children)[0]
+                rs_l_child = right_sp.children.sorted()[0]
                 if rs_l_child in visited: break
                 visited.add(rs_l_child)
                 if rs_l_child != currentChildIdx and rs_l_child not in self.nodes[currentChildIdx].children and rs_l_child not in self.nodes[currentChildIdx].parents:
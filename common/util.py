@@ -9,8 +9,9 @@ amr graph representaion and parsing util
 
 from collections import defaultdict
 import re,string
+import hashlib,struct,zlib
 import numpy as np
-from constants import START_ID
+from constants import START_ID,FEATURE_MIX_MULT
 
 # feature window placeholder
 
@@ -331,6 +332,11 @@ class Alphabet(object):
         """Get index from label"""
         return self._label_to_index[label] if label in self._label_to_index else None
         
+    def get_indices(self, labels):
+        """Get indexes of a list of labels as an array, -1 for unknown labels"""
+        get = self._label_to_index.get
+        return np.fromiter((get(label,-1) for label in labels),dtype=np.intp,count=len(labels))
+
     def get_default_index(self,label):
         """get index for label, if label is not in the alphabet, we add it"""
         if label in self._label_to_index:
@@ -391,3 +397,162 @@ class Alphabet(object):
         return self._index_to_label == other._index_to_label and \
             self._label_to_index == other._label_to_index and \
             self.num_labels == other.num_labels
+
+def feature_hash(label):
+    """stable 64-bit hash of a feature string, the same in every process and platform"""
+    if isinstance(label,(int,long)): return label # integer feature ids are hashed already
+    if isinstance(label,unicode): label = label.encode('utf-8')
+    return struct.unpack('<q',hashlib.md5(label).digest()[:8])[0]
+
+class HashedFeatureIndex(object):
+    """Feature codebook for the hashing trick
+
+    Maps every feature string to one of 2^bits rows by its crc32, so the
+    weight matrices have a fixed size and there is no dictionary to grow or store.
+    Integer feature ids go to the top bits of their 64-bit product with
+    FEATURE_MIX_MULT, so every bit of the id, template index included, picks the row.
+    Different features may share a row.
+    """
+    mix_ids = False # indexes pickled before keep the low bits of integer ids
+    def __init__(self, bits, mix_ids=True):
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.num_labels = 1 << bits
+        self.mix_ids = mix_ids
+
+    def size(self):
+        return self.num_labels
+
+    def __len__(self):
+        return self.size()
+
+    def has_label(self, label):
+        return True
+
+    def get_index(self, label):
+        """Get index from label"""
+        if isinstance(label,(int,long)):
+            if self.mix_ids: return ((label*FEATURE_MIX_MULT) & 0xffffffffffffffff) >> (64-self.bits)
+            return label & self.mask
+        if isinstance(label,unicode): label = label.encode('utf-8')
+        return zlib.crc32(label) & self.mask
+
+    get_default_index = get_index
+
+    def get_indices(self, labels):
+        """Get indexes of a list of labels as an array"""
+        if labels and isinstance(labels[0],(int,long)):
+            if self.mix_ids:
+                ids = np.fromiter(labels,dtype=np.uint64,count=len(labels))
+                return ((ids*np.uint64(FEATURE_MIX_MULT)) >> np.uint64(64-self.bits)).astype(np.intp)
+            return (np.fromiter(labels,dtype=np.int64,count=len(labels)) & self.mask).astype(np.intp)
+        return np.fromiter((self.get_index(label) for label in labels),dtype=np.intp,count=len(labels))
+
+class AtomTable(dict):
+    """Interns the atom values of feature templates as small integers
+
+    None is always 0, so a template fires when any of its atoms is non-zero.
+    While growing an unseen value gets the next id; once frozen it maps to -1,
+    every feature built on it is unknown to the codebook anyway.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self[None] = 0
+        self.growing = True
+
+    def __missing__(self, value):
+        if not self.growing:
+            return -1
+        i = self[value] = len(self)
+        return i
+
+    def __reduce__(self):
+        return (AtomTable, (), {'growing':self.growing}, None, self.iteritems())
+
+class FeatureProfile(object):
+    """Per-template statistics of the integer feature ids, see Model.profile_features
+
+    time is filled in by the profiled generator; fired, unique values and the
+    fired features the codebook doesn't know (wasted lookups) are counted at scoring time,
+    the state features shared by the candidates of a step once per step.
+    """
+    def __init__(self, num_templates, id_bits):
+        self.id_bits = id_bits
+        self.time = [.0]*num_templates
+        self.fired = [0]*num_templates
+        self.unknown = [0]*num_templates
+        self.values = [set() for i in xrange(num_templates)]
+
+    def count(self, features, indices, shared=frozenset(), known_shared=None):
+        """
+        features scored for one action class and their codebook indices, -1 for unknown;
+        the ones in shared are skipped, those the codebook knows are added to known_shared
+        """
+        for f,i in zip(features,indices):
+            if f in shared:
+                if i >= 0: known_shared.add(f)
+                continue
+            tid = f >> self.id_bits
+            self.fired[tid] += 1
+            self.values[tid].add(f)
+            if i < 0: self.unknown[tid] += 1
+
+    def dump(self, names, out):
+        """table of the templates, most expensive first"""
+        print >> out, '%-60s %10s %10s %10s %10s %10s' % ('template','fired','unique','unknown','time(s)','us/fire')
+        for tid in sorted(xrange(len(self.time)),key=lambda t:-self.time[t]):
+            fired = self.fired[tid]
+            print >> out, '%-60s %10d %10d %10d %10.3f %10.2f' % (names[tid],fired,len(self.values[tid]),self.unknown[tid],
+                                                                  self.time[tid],self.time[tid]*1e6/fired if fired else .0)
+        print >> out, '%-60s %10d %10d %10d %10.3f' % ('total',sum(self.fired),sum(len(v) for v in self.values),sum(self.unknown),sum(self.time))
+
+class MappedAlphabet(object):
+    """Read-only feature codebook for memory-mapped models
+
+    Instead of a dict from feature string to index it only keeps the sorted
+    64-bit hashes of the features, which can be loaded with np.load(mmap_mode='r')
+    and shared between processes. The index of a feature is the position
+    of its hash in the array, so the weight rows are stored in the same order.
+    """
+    def __init__(self, keys):
+        self._keys = keys
+        self.num_labels = len(keys)
+
+    @staticmethod
+    def sorted_keys(alphabet):
+        """
+        hash array for alphabet and the alphabet index of each of its positions;
+        features whose hash collides with an earlier one are dropped
+        """
+        if isinstance(alphabet,MappedAlphabet):
+            return np.asarray(alphabet._keys), np.arange(alphabet.size())
+        keys = np.fromiter((feature_hash(alphabet.get_label(i)) for i in xrange(alphabet.size())),dtype=np.int64,count=alphabet.size())
+        order = np.argsort(keys,kind='mergesort')
+        keys = keys[order]
+        if len(keys) > 1:
+            first = np.concatenate(([True],keys[1:] != keys[:-1]))
+            keys, order = keys[first], order[first]
+        return keys, order
+
+    def size(self):
+        return self.num_labels
+
+    def __len__(self):
+        return self.size()
+
+    def has_label(self, label):
+        return self.get_index(label) is not None
+
+    def get_index(self, label):
+        """Get index from label"""
+        key = feature_hash(label)
+        i = self._keys.searchsorted(key)
+        return int(i) if i < self.num_labels and self._keys[i] == key else None
+
+    def get_indices(self, labels):
+        """Get indexes of a list of labels as an array, -1 for unknown labels"""
+        keys = np.fromiter((feature_hash(label) for label in labels),dtype=np.int64,count=len(labels))
+        if self.num_labels == 0:
+            return -np.ones(len(labels),dtype=np.intp)
+        pos = np.minimum(self._keys.searchsorted(keys),self.num_labels-1)
+        return np.where(self._keys[pos] == keys,pos,-1)
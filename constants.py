@@ -1,6 +1,10 @@
 # all the constants 
 import numpy as np
 import re
+import os,marshal
+import hashlib,struct
+from array import array
+from bisect import bisect_left
 from os import listdir
 from collections import defaultdict
 
@@ -162,7 +166,79 @@ FEATS_ABBR['txv'] = 'txv'
 FEATS_ABBR['txn'] = 'txn'
 FEATS_ABBR['txdelta'] = 'txdelta'
 
-DEFAULT_RULE_FILE = './rules/dep2amrLabelRules'
+# resource tables are read on first use and cached in marshal form next to their source,
+# see _LazyResource; paths are relative to this file, not to the working directory
+RESOURCE_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def resource_key(path):
+    """mtime and size of a resource file, or of every file of a resource directory"""
+    if os.path.isdir(path):
+        return tuple((fn,)+resource_key(os.path.join(path,fn)) for fn in sorted(listdir(path)))
+    st = os.stat(path)
+    return (st.st_mtime,st.st_size)
+
+def _cached_load(loader,path):
+    """loader(path) through path.cache, rebuilt when the source changes"""
+    cache_file = path.rstrip('/')+'.cache'
+    key = (loader.__name__,resource_key(path))
+    try:
+        with open(cache_file,'rb') as f:
+            cached_key,data = marshal.load(f)
+        if cached_key == key:
+            return data
+    except (IOError,EOFError,ValueError,TypeError):
+        pass
+    data = loader(path)
+    try:
+        tmp_file = '%s.%d' % (cache_file,os.getpid())
+        with open(tmp_file,'wb') as f:
+            marshal.dump((key,data),f)
+        os.rename(tmp_file,cache_file)
+    except (IOError,OSError): # read-only checkout, load from source next time too
+        pass
+    except ValueError: # unmarshallable value, not cached
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+    return data
+
+class _LazyResource(object):
+    """
+    stands in for a table loaded from a resource file, it is built (or read from
+    its cache) when first used so importing constants stays cheap
+    """
+    def __init__(self,loader,path,convert=None):
+        self._loader = loader
+        self._path = path
+        self._convert = convert
+        self._data = None
+
+    def _table(self):
+        if self._data is None:
+            data = _cached_load(self._loader,self._path)
+            self._data = self._convert(data) if self._convert is not None else data
+        return self._data
+
+    def __contains__(self,key):
+        return key in self._table()
+
+    def __getitem__(self,key):
+        return self._table()[key]
+
+    def __setitem__(self,key,value):
+        self._table()[key] = value
+
+    def __iter__(self):
+        return iter(self._table())
+
+    def __len__(self):
+        return len(self._table())
+
+    def __getattr__(self,name):
+        return getattr(self._table(),name)
+
+DEFAULT_RULE_FILE = os.path.join(RESOURCE_ROOT,'rules/dep2amrLabelRules')
 
 def _load_rules(rule_file):
     rf = open(rule_file,'r')
@@ -175,11 +251,11 @@ def _load_rules(rule_file):
             pass
     return d
 
-__DEP_AMR_REL_TABLE = _load_rules(DEFAULT_RULE_FILE)
+__DEP_AMR_REL_TABLE = _LazyResource(_load_rules,DEFAULT_RULE_FILE)
 def get_fake_amr_relation_mapping(dep_rel):
     return __DEP_AMR_REL_TABLE[dep_rel]
 
-DEFAULT_NOM_FILE = './resources/nombank-dict.1.0'
+DEFAULT_NOM_FILE = os.path.join(RESOURCE_ROOT,'resources/nombank-dict.1.0')
 
 def _read_nom_list(nombank_dict_file):
     nomdict = open(nombank_dict_file,'r')
@@ -191,9 +267,90 @@ def _read_nom_list(nombank_dict_file):
             nomlist.append(m.group(1))
     return nomlist
 
-NOMLIST = _read_nom_list(DEFAULT_NOM_FILE)
-
-DEFAULT_BROWN_CLUSTER = './resources/wclusters-engiga'
+NOMLIST = _LazyResource(_read_nom_list,DEFAULT_NOM_FILE,frozenset) # only tested for membership
+
+DEFAULT_BROWN_CLUSTER = os.path.join(RESOURCE_ROOT,'resources/wclusters-engiga')
+BROWN_PREFIX_LEN=(4,6,8,10,20) # cluster prefixes used as features
+BROWN_ATOMICS=tuple('brown%d'%l for l in BROWN_PREFIX_LEN)
+
+def _token_hash(tok):
+    """md5 of the token as a C long, the item type of BrownClusters' key array"""
+    if isinstance(tok,unicode): tok = tok.encode('utf-8')
+    return struct.unpack('l',hashlib.md5(tok).digest()[:struct.calcsize('l')])[0]
+
+class BrownClusters(object):
+    """
+    Brown cluster table without a dict of strings: arrays of the sorted hashes
+    of the tokens and the cluster of each, and per cluster its BROWN_PREFIX_LEN prefixes both as
+    strings and as integer ids (the prefix bits under a leading 1, so lengths don't clash).
+    all the prefixes of a token are one lookup; a token without cluster has empty prefixes
+    """
+    def __init__(self,keys,clusters,bitstrings):
+        self._keys = keys
+        self._clusters = clusters
+        self._bitstrings = []
+        self._prefixes = []
+        self._prefix_ids = []
+        self._added = {} # tokens set after loading
+        for bitstring in bitstrings:
+            self._add_cluster(bitstring)
+        self._empty_prefixes = ('',)*len(BROWN_PREFIX_LEN)
+        self._empty_prefix_ids = (1,)*len(BROWN_PREFIX_LEN)
+
+    def _add_cluster(self,bitstring):
+        self._bitstrings.append(bitstring)
+        self._prefixes.append(tuple(bitstring[:l] for l in BROWN_PREFIX_LEN))
+        self._prefix_ids.append(tuple(int('1'+bitstring[:l],2) for l in BROWN_PREFIX_LEN))
+        return len(self._bitstrings)-1
+
+    @staticmethod
+    def from_dict(cluster_dict):
+        bitstrings = sorted(set(cluster_dict.values()))
+        index = dict((b,i) for i,b in enumerate(bitstrings))
+        toks = cluster_dict.keys()
+        keys = np.fromiter((_token_hash(tok) for tok in toks),dtype=np.int_,count=len(toks))
+        clusters = np.fromiter((index[cluster_dict[tok]] for tok in toks),dtype=np.int32,count=len(toks))
+        order = np.argsort(keys,kind='mergesort')
+        return BrownClusters(array('l',keys[order].tostring()),array('i',clusters[order].tostring()),bitstrings)
+
+    def to_marshal(self):
+        return (self._keys.tostring(),self._clusters.tostring(),self._bitstrings)
+
+    @staticmethod
+    def from_marshal(data):
+        keys,clusters,bitstrings = data
+        return BrownClusters(array('l',keys),array('i',clusters),bitstrings)
+
+    def _cluster(self,tok):
+        if tok in self._added:
+            return self._added[tok]
+        key = _token_hash(tok)
+        i = bisect_left(self._keys,key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._clusters[i]
+        return -1
+
+    def prefixes(self,tok):
+        c = self._cluster(tok)
+        return self._prefixes[c] if c >= 0 else self._empty_prefixes
+
+    def prefix_ids(self,tok):
+        c = self._cluster(tok)
+        return self._prefix_ids[c] if c >= 0 else self._empty_prefix_ids
+
+    def __contains__(self,tok):
+        return self._cluster(tok) >= 0
+
+    def __getitem__(self,tok):
+        """the cluster bitstring, empty for unknown tokens like the defaultdict(str) this replaces"""
+        c = self._cluster(tok)
+        return self._bitstrings[c] if c >= 0 else ''
+
+    def __setitem__(self,tok,bitstring):
+        self._added[tok] = self._add_cluster(bitstring)
+
+    def __len__(self):
+        return len(self._keys)+len(self._added)
     
 def _load_brown_cluster(dir_path,cluster_num=1000):
     cluster_dict = defaultdict(str)
@@ -206,9 +363,19 @@ def _load_brown_cluster(dir_path,cluster_num=1000):
 
     return cluster_dict
 
-BROWN_CLUSTER=_load_brown_cluster(DEFAULT_BROWN_CLUSTER)
+def _load_brown_store(dir_path):
+    return BrownClusters.from_dict(_load_brown_cluster(dir_path)).to_marshal()
+
+BROWN_CLUSTER=_LazyResource(_load_brown_store,DEFAULT_BROWN_CLUSTER,BrownClusters.from_marshal)
+
+# dependency path features are a rolling hash over the interned pos/rel ids along the path
+PATH_HASH_BASE=1000003
+PATH_HASH_MASK=(1<<61)-1
+# integer feature ids, see Model._append_feats and HashedFeatureIndex
+FEATURE_TID_MULT=0x9e3779b1
+FEATURE_MIX_MULT=0x9e3779b97f4a7c15
 
-PATH_TO_VERB_LIST = './resources/verbalization-list-v1.01.txt'
+PATH_TO_VERB_LIST = os.path.join(RESOURCE_ROOT,'resources/verbalization-list-v1.01.txt')
 
 def _load_verb_list(path_to_file):
     verbdict = {}
@@ -233,9 +400,9 @@ def _load_verb_list(path_to_file):
 
     return verbdict
 
-VERB_LIST = _load_verb_list(PATH_TO_VERB_LIST)
+VERB_LIST = _LazyResource(_load_verb_list,PATH_TO_VERB_LIST)
 
-PATH_TO_COUNTRY_LIST='./resources/country-list.csv'
+PATH_TO_COUNTRY_LIST=os.path.join(RESOURCE_ROOT,'resources/country-list.csv')
 
 def _load_country_list(path_to_file):
     countrydict = {}
@@ -247,7 +414,7 @@ def _load_country_list(path_to_file):
 
     return countrydict
     
-COUNTRY_LIST=_load_country_list(PATH_TO_COUNTRY_LIST)
+COUNTRY_LIST=_LazyResource(_load_country_list,PATH_TO_COUNTRY_LIST)
                 
 
 # given different domain, return range of split corpus #TODO: move this part to config file
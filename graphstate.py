@@ -5,7 +5,6 @@
 #
 from __future__ import absolute_import
 import copy,sys,re
-import cPickle
 from parser import *
 from common.util import *
 from constants import *
@@ -24,24 +23,92 @@ class ActionTable(dict):
         key =  len(self.keys())+1
         self[key] = action_name
     
+class SentenceContext(object):
+    """
+    Per-sentence data shared by all the states of one parse: tokens, dependency tree,
+    gold graph. Keeping it off the class lets several sentences be decoded at once
+    """
+    def __init__(self,instance,deptree,verbose=0):
+        self.text = instance.text
+        self.sent = instance.tokens
+        #self.abt_tokens = {}
+        self.gold_graph = instance.gold_graph
+        self.deptree = deptree
+        self.sentID = instance.comment['id'] if instance.comment else instance.sentID
+        self.verbose = verbose
+        self.atomics = None
+        self.abt_atomics = None
+        self.path_feats = {} # dependency path features by node pair and span, see GraphState._path_feats
+        self.apath_feats = {}
+        self.atom_table = None
+        self.path_ids = None
+
+    def init_atomics(self,brown_ids=False):
+        """
+        static token attributes read by every feature window, indexed by token id;
+        the graph-dependent fields are overlaid on a copy per action.
+        brown_ids: integer brown cluster prefixes instead of strings, see BrownClusters
+        """
+        self.atomics = [SentenceContext.token_atomics(tok,brown_ids) for tok in self.sent]
+        self.abt_atomics = SentenceContext.token_atomics(ABT_TOKEN,brown_ids)
+
+    def init_path_ids(self,atom_table):
+        """
+        atom ids of what each token contributes to a dependency path feature:
+        (pos,rel), rel, the pathprep and the apathprep element
+        """
+        self.atom_table = atom_table
+        self.xx_id = atom_table[('X','X')]
+        self.path_ids = [self.token_path_ids(a) for a in self.atomics]
+
+    def token_path_ids(self,atomics):
+        A = self.atom_table
+        pr = A[(atomics['pos'],atomics['rel'])]
+        if atomics['isprep']:
+            prep = A[atomics['form']]
+            return (pr,A[atomics['rel']],prep,prep)
+        return (pr,A[atomics['rel']],self.xx_id,pr)
+
+    @staticmethod
+    def token_atomics(tok,brown_ids=False):
+        atomics = {'form':tok['form'],
+                   'lemma':tok['lemma'],
+                   'pos':tok['pos'],
+                   'ne':tok['ne'],
+                   'rel':tok['rel'] if 'rel' in tok else EMPTY,
+                   'frmset':tok['frmset'] if 'frmset' in tok else NOT_ASSIGNED,
+                   'isnom':tok['lemma'].lower() in NOMLIST
+                  }
+        if 'id' in tok: atomics['id'] = tok['id']
+        atomics['isprep'] = atomics['pos'] == 'IN' and atomics['rel'] == 'prep'
+        brown_prefixes = BROWN_CLUSTER.prefix_ids(tok['form']) if brown_ids else BROWN_CLUSTER.prefixes(tok['form'])
+        atomics.update(zip(BROWN_ATOMICS,brown_prefixes))
+        return atomics
+
+    def set_rel(self,idx,rel):
+        """dependency label of a token changes when nodes are merged"""
+        self.sent[idx]['rel'] = rel
+        atomics = self.atomics[idx]
+        atomics['rel'] = rel
+        atomics['isprep'] = atomics['pos'] == 'IN' and rel == 'prep'
+        if self.path_ids is not None:
+            self.path_ids[idx] = self.token_path_ids(atomics)
+        self.path_feats.clear()
+        self.apath_feats.clear()
+
 class GraphState(object):
     """
     Starting from dependency graph, each state represents subgraph in parsing process
     Indexed by current node being handled
     """
     
-    sent = None
-    #abt_tokens = None
-    deptree = None
     action_table = None
     #new_actions = None
-    sentID = 0
-    gold_graph = None
     model = None
-    verbose = None
     
     
-    def __init__(self,sigma,A):
+    def __init__(self,sigma,A,ctx):
+        self.ctx = ctx
         self.sigma = sigma
         self.idx = self.sigma.top()
         self.cidx = None
@@ -53,7 +120,7 @@ class GraphState(object):
         #else:
         #    self.cidx = None
         self.A = A
-        self.action_history = []
+        self.action_history = None # linked list (last action, previous history) shared between states
 
         #self.left_label_set = set([])
         #self._init_atomics()
@@ -73,19 +140,18 @@ class GraphState(object):
         sigma = Buffer(seq)        
         sigma.push(START_ID)
 
-        GraphState.text = instance.text
-        GraphState.sent = instance.tokens
-        #GraphState.abt_tokens = {}
-        GraphState.gold_graph = instance.gold_graph
-        if GraphState.gold_graph: GraphState.gold_graph.abt_node_table = {}
-        GraphState.deptree = depGraph
-        GraphState.sentID = instance.comment['id'] if instance.comment else GraphState.sentID + 1
-        GraphState.verbose = verbose
+        A = copy.deepcopy(depGraph)
+        depGraph.cache_paths() # the dependency tree stays fixed from here on
+        ctx = SentenceContext(instance,depGraph,verbose)
+        ctx.init_atomics(getattr(GraphState.model,'brown_ids',False))
+        if getattr(GraphState.model,'path_hash',False):
+            ctx.init_path_ids(GraphState.model.atom_table)
+        if ctx.gold_graph: ctx.gold_graph.abt_node_table = {}
         
         if verbose > 1:
-            print >> sys.stderr,"Sentence ID:%s, initial sigma:%s" % (GraphState.sentID,sigma)
+            print >> sys.stderr,"Sentence ID:%s, initial sigma:%s" % (ctx.sentID,sigma)
 
-        return GraphState(sigma,copy.deepcopy(depGraph))
+        return GraphState(sigma,A,ctx)
 
     @staticmethod
     def init_action_table(actions):
@@ -102,14 +168,14 @@ class GraphState(object):
         """
         
         # first parent of current node
-        sp1 = GraphState.sent[self.A.nodes[self.idx].parents[0]] if self.A.nodes[self.idx].parents else NOT_ASSIGNED
+        sp1 = self.ctx.sent[self.A.nodes[self.idx].parents[0]] if self.A.nodes[self.idx].parents else NOT_ASSIGNED
         # immediate left sibling, immediate right sibling and second right sibling
         if sp1 != NOT_ASSIGNED and len(self.A.nodes[sp1['id']].children) > 1:
             children = self.A.nodes[sp1['id']].children
-            idx_order = sorted(children).index(self.idx)
-            slsb = GraphState.sent[children[idx_order-1]] if idx_order > 0 else NOT_ASSIGNED
-            srsb = GraphState.sent[children[idx_order+1]] if idx_order < len(children)-1 else NOT_ASSIGNED
-            sr2sb = GraphState.sent[children[idx_order+2]] if idx_order < len(children)-2 else NOT_ASSIGNED
+            idx_order = self.A.child_position(sp1['id'],self.idx)
+            slsb = self.ctx.sent[children[idx_order-1]] if idx_order > 0 else NOT_ASSIGNED
+            srsb = self.ctx.sent[children[idx_order+1]] if idx_order < len(children)-1 else NOT_ASSIGNED
+            sr2sb = self.ctx.sent[children[idx_order+2]] if idx_order < len(children)-2 else NOT_ASSIGNED
         else:
             slsb = EMPTY
             srsb = EMPTY
@@ -117,11 +183,11 @@ class GraphState(object):
         
         '''
         # left first parent of current node
-        slp1 = GraphState.sent[self.A.nodes[self.idx].parents[0]] if self.A.nodes[self.idx].parents and self.A.nodes[self.idx].parents[0] < self.idx else NOT_ASSIGNED
+        slp1 = self.ctx.sent[self.A.nodes[self.idx].parents[0]] if self.A.nodes[self.idx].parents and self.A.nodes[self.idx].parents[0] < self.idx else NOT_ASSIGNED
         # right last child of current child
-        brc1 = GraphState.sent[self.deptree.nodes[self.cidx].children[-1]] if self.cidx and self.A.nodes[self.cidx].children and self.A.nodes[self.cidx].children[-1] > self.cidx  else NOT_ASSIGNED
+        brc1 = self.ctx.sent[self.ctx.deptree.nodes[self.cidx].children[-1]] if self.cidx and self.A.nodes[self.cidx].children and self.A.nodes[self.cidx].children[-1] > self.cidx  else NOT_ASSIGNED
         # left first parent of current child
-        blp1 = GraphState.sent[self.A.nodes[self.cidx].parents[0]] if self.cidx and self.A.nodes[self.cidx].parents and self.A.nodes[self.cidx].parents[0] < self.cidx else NOT_ASSIGNED
+        blp1 = self.ctx.sent[self.A.nodes[self.cidx].parents[0]] if self.cidx and self.A.nodes[self.cidx].parents and self.A.nodes[self.cidx].parents[0] < self.cidx else NOT_ASSIGNED
         '''
         self.atomics = [{'id':tok['id'],
                          'form':tok['form'],
@@ -134,10 +200,19 @@ class GraphState(object):
                          'srsb':srsb,
                          'sr2sb':sr2sb
                         } 
-                        for tok in GraphState.sent] # atomic features for current state
+                        for tok in self.ctx.sent] # atomic features for current state
         
     def pcopy(self):
-        return cPickle.loads(cPickle.dumps(self,-1))
+        """
+        copy-on-write successor state: buffers are copied, the graph shares
+        all the nodes an action doesn't touch with this state
+        """
+        newstate = GraphState.__new__(GraphState)
+        newstate.__dict__.update(self.__dict__)
+        newstate.sigma = Buffer(self.sigma)
+        newstate.beta = Buffer(self.beta) if self.beta is not None else None
+        newstate.A = self.A.pcopy()
+        return newstate
     
     def is_terminal(self):
         """done traverse the graph"""
@@ -187,9 +262,9 @@ class GraphState(object):
         tag_codebook = GraphState.model.tag_codebook
 
         if isinstance(currentIdx,int): 
-            current_tok_lemma = ','.join(tok['lemma'] for tok in GraphState.sent if tok['id'] in range(currentNode.start,currentNode.end))
-            current_tok_form = ','.join(tok['form'] for tok in GraphState.sent if tok['id'] in range(currentNode.start,currentNode.end))
-            current_tok_ne = GraphState.sent[currentIdx]['ne'] 
+            current_tok_lemma = ','.join(tok['lemma'] for tok in self.ctx.sent if tok['id'] in range(currentNode.start,currentNode.end))
+            current_tok_form = ','.join(tok['form'] for tok in self.ctx.sent if tok['id'] in range(currentNode.start,currentNode.end))
+            current_tok_ne = self.ctx.sent[currentIdx]['ne'] 
         else:
             current_tok_form = ABT_TOKEN['form']
             current_tok_lemma = ABT_TOKEN['lemma'] #if currentIdx != START_ID else START_TOKEN['lemma']
@@ -258,9 +333,9 @@ class GraphState(object):
             else:
                 all_candidate_tags.append(current_tok_lemma.lower())  # for decoding
 
-            if isinstance(currentIdx,int) and 'frmset' in GraphState.sent[currentIdx] \
-               and GraphState.sent[currentIdx]['frmset'] not in all_candidate_tags:
-                all_candidate_tags.append(GraphState.sent[currentIdx]['frmset'])
+            if isinstance(currentIdx,int) and 'frmset' in self.ctx.sent[currentIdx] \
+               and self.ctx.sent[currentIdx]['frmset'] not in all_candidate_tags:
+                all_candidate_tags.append(self.ctx.sent[currentIdx]['frmset'])
 
 
             if not currentNode.children and currentIdx != 0:
@@ -271,38 +346,35 @@ class GraphState(object):
         return actions
 
     def get_node_context(self,idx):
+        atomics = self.ctx.atomics
+        abt_atomics = self.ctx.abt_atomics
         # first parent of current node
         if self.A.nodes[idx].parents:
-            p1 = GraphState.sent[self.A.nodes[idx].parents[0]] if isinstance(self.A.nodes[idx].parents[0],int) else ABT_TOKEN
-            p1_brown_repr = BROWN_CLUSTER[p1['form']]
-            p1['brown4'] = p1_brown_repr[:4] if len(p1_brown_repr) > 3 else p1_brown_repr
-            p1['brown6'] = p1_brown_repr[:6] if len(p1_brown_repr) > 5 else p1_brown_repr
-            p1['brown10'] = p1_brown_repr[:10] if len(p1_brown_repr) > 9 else p1_brown_repr
-            p1['brown20'] = p1_brown_repr[:20] if len(p1_brown_repr) > 19 else p1_brown_repr
+            p1 = atomics[self.A.nodes[idx].parents[0]] if isinstance(self.A.nodes[idx].parents[0],int) else abt_atomics
         else:
             p1 = NOT_ASSIGNED
         if isinstance(idx,int):
-            prs1 = GraphState.sent[idx-1] if idx > 0 else NOT_ASSIGNED
-            prs2 = GraphState.sent[idx-2] if idx > 1 else NOT_ASSIGNED
+            prs1 = atomics[idx-1] if idx > 0 else NOT_ASSIGNED
+            prs2 = atomics[idx-2] if idx > 1 else NOT_ASSIGNED
         else:
-            prs1 = ABT_TOKEN
-            prs2 = ABT_TOKEN
+            prs1 = abt_atomics
+            prs2 = abt_atomics
         
 
         # immediate left sibling, immediate right sibling and second right sibling
         if p1 != NOT_ASSIGNED and len(self.A.nodes[self.A.nodes[idx].parents[0]].children) > 1:
             children = self.A.nodes[self.A.nodes[idx].parents[0]].children
-            idx_order = sorted(children).index(idx)
+            idx_order = self.A.child_position(self.A.nodes[idx].parents[0],idx)
             if idx_order > 0:
-                lsb = GraphState.sent[children[idx_order-1]] if isinstance(children[idx_order-1],int) else ABT_TOKEN
+                lsb = atomics[children[idx_order-1]] if isinstance(children[idx_order-1],int) else abt_atomics
             else:
                 lsb = NOT_ASSIGNED
             if idx_order < len(children)-1:
-                rsb = GraphState.sent[children[idx_order+1]] if isinstance(children[idx_order+1],int) else ABT_TOKEN
+                rsb = atomics[children[idx_order+1]] if isinstance(children[idx_order+1],int) else abt_atomics
             else: 
                 rsb = NOT_ASSIGNED
             if idx_order < len(children)-2:
-                r2sb = GraphState.sent[children[idx_order+2]] if isinstance(children[idx_order+2],int) else ABT_TOKEN
+                r2sb = atomics[children[idx_order+2]] if isinstance(children[idx_order+2],int) else abt_atomics
             else:
                 r2sb = NOT_ASSIGNED
         else:
@@ -314,36 +386,13 @@ class GraphState(object):
         
     def get_feature_context_window(self,action):
         """context window for current node and its child"""
-        def isprep(token):
-            return token['pos'] == 'IN' and token['rel'] == 'prep'
-        def delta_func(tag_to_predict,tok_form):
-            if isinstance(tag_to_predict,(ConstTag,ETag)):
-                return 'ECTag'
-            else:
-                tok_form = tok_form.lower()
-                tag_lemma = tag_to_predict.split('-')[0]
-                if tag_lemma == tok_form:
-                    return '1'
-                i=0
-                slength = len(tag_lemma) if len(tag_lemma) < len(tok_form) else len(tok_form)
-                while i < slength and tag_lemma[i] == tok_form[i]:
-                    i += 1
-                if i == 0:
-                    return '0'
-                elif tok_form[i:]:
-                    return tok_form[i:]
-                elif tag_lemma[i:]:
-                    return tag_lemma[i:]
-                else:
-                    assert False
-            
-        s0_atomics = GraphState.sent[self.idx].copy() if isinstance(self.idx,int) else ABT_TOKEN #GraphState.abt_tokens[self.idx]
-        s0_brown_repr = BROWN_CLUSTER[s0_atomics['form']]
-        s0_atomics['brown4'] = s0_brown_repr[:4] if len(s0_brown_repr) > 3 else s0_brown_repr
-        s0_atomics['brown6'] = s0_brown_repr[:6] if len(s0_brown_repr) > 5 else s0_brown_repr
-        s0_atomics['brown8'] = s0_brown_repr[:8] if len(s0_brown_repr) > 7 else s0_brown_repr
-        s0_atomics['brown10'] = s0_brown_repr[:10] if len(s0_brown_repr) > 9 else s0_brown_repr
-        s0_atomics['brown20'] = s0_brown_repr[:20] if len(s0_brown_repr) > 19 else s0_brown_repr
+        s0_atomics,b0_atomics = self.get_state_context_window()
+        return self.get_action_context_window(action,s0_atomics,b0_atomics)[:3]
+
+    def get_state_context_window(self):
+        """the part of the context window shared by all the candidate actions of this state"""
+        atomics = self.ctx.atomics
+        s0_atomics = atomics[self.idx].copy() if isinstance(self.idx,int) else self.ctx.abt_atomics.copy() #GraphState.abt_tokens[self.idx]
 
         
         #s0_atomics['pfx'] = s0_atomics['form'][:4] if len(s0_atomics['form']) > 3 else s0_atomics['form']
@@ -356,9 +405,9 @@ class GraphState(object):
         s0_atomics['r2sb']=sr2sb
         s0_atomics['len']=self.A.nodes[self.idx].end - self.A.nodes[self.idx].start if isinstance(self.idx,int) else NOT_ASSIGNED
         #s0_atomics['cap']=s0_atomics['form'].istitle()
-        s0_atomics['dch']=sorted([GraphState.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.idx].del_child])
-        s0_atomics['reph']=sorted([GraphState.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.idx].rep_parent])
-        #s0_atomics['nech'] = len(set(GraphState.sent[j]['ne'] if isinstance(j,int) else ABT_NE for j in self.A.nodes[self.idx].children) & INFER_NETAG) > 0
+        s0_atomics['dch']=sorted([self.ctx.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.idx].del_child])
+        s0_atomics['reph']=sorted([self.ctx.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.idx].rep_parent])
+        #s0_atomics['nech'] = len(set(self.ctx.sent[j]['ne'] if isinstance(j,int) else ABT_NE for j in self.A.nodes[self.idx].children) & INFER_NETAG) > 0
         #s0_atomics['isnom'] = s0_atomics['lemma'] in NOMLIST
 
         core_args = set([self.A.get_edge_label(self.idx,child) for child in self.A.nodes[self.idx].children if self.A.get_edge_label(self.idx,child).startswith('ARG') and child != self.cidx])
@@ -367,23 +416,9 @@ class GraphState(object):
         s0_atomics['arg1']='ARG1' in core_args
         s0_atomics['arg2']='ARG2' in core_args
 
-        # prop feature
-        s0_atomics['frmset']=GraphState.sent[self.idx]['frmset'] if isinstance(self.idx,int) and 'frmset' in GraphState.sent[self.idx] else NOT_ASSIGNED
-
         # mod here
-        # next2 specific features
+        # next2 specific features; the tag dependent ones are set per action
         if not self.cidx:
-            if 'tag' in action: # next2
-                tag_to_predict = action['tag']
-                s0_atomics['eqfrmset'] = s0_atomics['frmset'] == tag_to_predict if s0_atomics['frmset'] is not NOT_ASSIGNED else NOT_ASSIGNED
-                s0_atomics['txv'] = len(tag_to_predict.split('-'))==2
-                s0_atomics['txn'] = isinstance(tag_to_predict,ETag)
-                s0_atomics['txdelta'] = delta_func(tag_to_predict,s0_atomics['form'])
-            else:
-                s0_atomics['txv'] = NOT_ASSIGNED
-                s0_atomics['txn'] = NOT_ASSIGNED
-                s0_atomics['txdelta'] = NOT_ASSIGNED
-                s0_atomics['eqfrmset'] = NOT_ASSIGNED
             s0_atomics['isleaf'] = len(self.A.nodes[self.idx].children) == 0
         else:
             s0_atomics['txv'] = NOT_APPLY
@@ -394,19 +429,13 @@ class GraphState(object):
         
         s0_args = None
         s0_prds = None
-        if isinstance(self.idx,int) and GraphState.sent[self.idx].get('args',{}):
-            s0_args = GraphState.sent[self.idx]['args']
-        if isinstance(self.idx,int) and GraphState.sent[self.idx].get('pred',{}):
-            s0_prds = GraphState.sent[self.idx]['pred']
+        if isinstance(self.idx,int) and self.ctx.sent[self.idx].get('args',{}):
+            s0_args = self.ctx.sent[self.idx]['args']
+        if isinstance(self.idx,int) and self.ctx.sent[self.idx].get('pred',{}):
+            s0_prds = self.ctx.sent[self.idx]['pred']
         
         if self.cidx and self.cidx != START_ID:
-            b0_atomics = GraphState.sent[self.cidx].copy() if isinstance(self.cidx,int) else ABT_TOKEN #GraphState.abt_tokens[self.cidx]
-            b0_brown_repr = BROWN_CLUSTER[b0_atomics['form']]
-            b0_atomics['brown4'] = b0_brown_repr[:4] if len(b0_brown_repr) > 3 else b0_brown_repr
-            b0_atomics['brown6'] = b0_brown_repr[:6] if len(b0_brown_repr) > 5 else b0_brown_repr
-            b0_atomics['brown8'] = b0_brown_repr[:8] if len(b0_brown_repr) > 7 else b0_brown_repr
-            b0_atomics['brown10'] = b0_brown_repr[:10] if len(b0_brown_repr) > 9 else b0_brown_repr
-            b0_atomics['brown20'] = b0_brown_repr[:20] if len(b0_brown_repr) > 19 else b0_brown_repr
+            b0_atomics = atomics[self.cidx].copy() if isinstance(self.cidx,int) else self.ctx.abt_atomics.copy() #GraphState.abt_tokens[self.cidx]
             b0_atomics['concept'] = self.A.nodes[self.cidx].tag
             bprs2,bprs1,bp1,blsb,brsb,br2sb = self.get_node_context(self.cidx)
             b0_atomics['prs1']=bprs1
@@ -416,9 +445,9 @@ class GraphState(object):
             b0_atomics['rsb']=brsb
             b0_atomics['r2sb']=br2sb
             b0_atomics['nswp']=self.A.nodes[self.cidx].num_swap
-            b0_atomics['reph']=sorted([GraphState.sent[rp]['form'] if isinstance(rp,int) else ABT_FORM for rp in self.A.nodes[self.cidx].rep_parent])
+            b0_atomics['reph']=sorted([self.ctx.sent[rp]['form'] if isinstance(rp,int) else ABT_FORM for rp in self.A.nodes[self.cidx].rep_parent])
             b0_atomics['len']=self.A.nodes[self.cidx].end - self.A.nodes[self.cidx].start if isinstance(self.cidx,int) else NOT_ASSIGNED
-            b0_atomics['dch']=sorted([GraphState.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.cidx].del_child])
+            b0_atomics['dch']=sorted([self.ctx.sent[j]['form'].lower() if isinstance(j,int) else ABT_FORM for j in self.A.nodes[self.cidx].del_child])
             b0_atomics['eqne']=(s0_atomics['ne']==b0_atomics['ne'] and b0_atomics['ne'] in PRE_MERGE_NETAG)
             b0_atomics['isne']=b0_atomics['ne'] in PRE_MERGE_NETAG
             b0_atomics['hastrace'] = len(self.A.nodes[self.cidx].incoming_traces) > 0
@@ -431,23 +460,7 @@ class GraphState(object):
             b0_atomics['prdlabel']=s0_prds[self.cidx] if b0_atomics['isprd'] else NOT_ASSIGNED
             
             if isinstance(self.cidx,int) and isinstance(self.idx,int):
-                path,direction = GraphState.deptree.get_path(self.cidx,self.idx)
-                if self.A.nodes[self.idx].end - self.A.nodes[self.idx].start > 1:
-                    path_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1] if i not in range(self.A.nodes[self.idx].start,self.A.nodes[self.idx].end)]
-                    path_x_str_pp = [('X','X') if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form'] for i in path[1:-1] if i not in range(self.A.nodes[self.idx].start,self.A.nodes[self.idx].end)]
-                else:
-                    path_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
-                    path_x_str_pp = [('X','X') if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form']  for i in path[1:-1]]
-                path_pos_str.insert(0,GraphState.sent[path[0]]['rel'])
-                path_pos_str.append(GraphState.sent[path[-1]]['rel'])
-
-                path_x_str_pp.insert(0,GraphState.sent[path[0]]['rel'])
-                path_x_str_pp.append(GraphState.sent[path[-1]]['rel'])
-
-                b0_atomics['pathp'] = path_pos_str
-                b0_atomics['pathprep'] = path_x_str_pp
-                b0_atomics['pathpwd'] = str(path_pos_str) + direction
-                b0_atomics['pathprepwd'] = str(path_x_str_pp) + direction
+                b0_atomics['pathp'],b0_atomics['pathprep'],b0_atomics['pathpwd'],b0_atomics['pathprepwd'] = self._path_feats(self.cidx,self.idx)
             else:
                 b0_atomics['pathp'] = EMPTY
                 b0_atomics['pathprep'] = EMPTY
@@ -464,6 +477,162 @@ class GraphState(object):
             b0_atomics = EMPTY
         
             
+        if self.cidx == START_ID:
+            s0_atomics['nech'] = len(set(self.ctx.sent[j]['ne'] if isinstance(j,int) else ABT_NE for j in self.A.nodes[self.idx].children) & INFER_NETAG) > 0 
+            s0_atomics['concept']=self.A.nodes[self.idx].tag
+            if self.A.nodes[self.idx].children: 
+                c1 = self.A.nodes[self.idx].children[0]
+                s0_atomics['c1lemma'] = self.ctx.sent[c1]['lemma'].lower() if isinstance(c1,int) else ABT_LEMMA
+                s0_atomics['c1dl'] = self.ctx.sent[c1]['rel'] if isinstance(c1,int) else ABT_LEMMA
+            else:
+                s0_atomics['c1lemma'] = EMPTY
+                s0_atomics['c1dl'] = EMPTY
+        else:
+            s0_atomics['c1lemma'] = NOT_APPLY#EMPTY
+            s0_atomics['concept'] = NOT_APPLY#EMPTY
+            s0_atomics['nech'] = NOT_APPLY#EMPTY
+            s0_atomics['isnom'] = NOT_APPLY#EMPTY
+            s0_atomics['c1dl'] = NOT_APPLY#EMPTY
+        return s0_atomics,b0_atomics
+
+    def _path_feats(self,cidx,idx):
+        """
+        pathp,pathprep,pathpwd,pathprepwd between cidx and idx on the dependency tree,
+        memoized per sentence by node pair and the span of idx; shared, don't modify.
+        integers for models with path_hash, lists and strings for older ones
+        """
+        start,end = self.A.nodes[idx].start,self.A.nodes[idx].end
+        key = (cidx,idx,start,end)
+        if key in self.ctx.path_feats:
+            return self.ctx.path_feats[key]
+        path,direction = self.ctx.deptree.get_path(cidx,idx)
+        if self.ctx.path_ids is not None:
+            ids = self.ctx.path_ids
+            skip = end - start > 1
+            hp = hpp = ids[path[0]][1]
+            for i in path[1:-1]:
+                if skip and start <= i < end: continue
+                t = ids[i]
+                hp = (hp*PATH_HASH_BASE + t[0]) & PATH_HASH_MASK
+                hpp = (hpp*PATH_HASH_BASE + t[2]) & PATH_HASH_MASK
+            r = ids[path[-1]][1]
+            hp = (hp*PATH_HASH_BASE + r) & PATH_HASH_MASK
+            hpp = (hpp*PATH_HASH_BASE + r) & PATH_HASH_MASK
+            d = self.ctx.atom_table[direction]
+            feats = (hp,hpp,(hp*PATH_HASH_BASE + d) & PATH_HASH_MASK,(hpp*PATH_HASH_BASE + d) & PATH_HASH_MASK)
+            self.ctx.path_feats[key] = feats
+            return feats
+        atomics = self.ctx.atomics
+        if end - start > 1:
+            path_pos_str = [(atomics[i]['pos'],atomics[i]['rel']) for i in path[1:-1] if i not in range(start,end)]
+            path_x_str_pp = [('X','X') if not atomics[i]['isprep'] else atomics[i]['form'] for i in path[1:-1] if i not in range(start,end)]
+        else:
+            path_pos_str = [(atomics[i]['pos'],atomics[i]['rel']) for i in path[1:-1]]
+            path_x_str_pp = [('X','X') if not atomics[i]['isprep'] else atomics[i]['form']  for i in path[1:-1]]
+        path_pos_str.insert(0,atomics[path[0]]['rel'])
+        path_pos_str.append(atomics[path[-1]]['rel'])
+
+        path_x_str_pp.insert(0,atomics[path[0]]['rel'])
+        path_x_str_pp.append(atomics[path[-1]]['rel'])
+
+        feats = (path_pos_str,path_x_str_pp,str(path_pos_str) + direction,str(path_x_str_pp) + direction)
+        self.ctx.path_feats[key] = feats
+        return feats
+
+    def _apath_feats(self,cidx,parent_to_attach):
+        """apathx,apathp,apathprep and their directed forms, memoized like _path_feats"""
+        start,end = self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end
+        key = (cidx,parent_to_attach,start,end)
+        if key in self.ctx.apath_feats:
+            return self.ctx.apath_feats[key]
+        path,direction = self.ctx.deptree.get_path(cidx,parent_to_attach)
+        if self.ctx.path_ids is not None:
+            ids = self.ctx.path_ids
+            skip = end - start > 1
+            hx = hp = hpp = ids[path[0]][1]
+            for i in path[1:-1]:
+                if skip and start <= i < end: continue
+                t = ids[i]
+                hx = (hx*PATH_HASH_BASE + self.ctx.xx_id) & PATH_HASH_MASK
+                hp = (hp*PATH_HASH_BASE + t[0]) & PATH_HASH_MASK
+                hpp = (hpp*PATH_HASH_BASE + t[3]) & PATH_HASH_MASK
+            r = ids[path[-1]][1]
+            hx = (hx*PATH_HASH_BASE + r) & PATH_HASH_MASK
+            hp = (hp*PATH_HASH_BASE + r) & PATH_HASH_MASK
+            hpp = (hpp*PATH_HASH_BASE + r) & PATH_HASH_MASK
+            d = self.ctx.atom_table[direction]
+            feats = (hx,hp,hpp,(hx*PATH_HASH_BASE + d) & PATH_HASH_MASK,
+                     (hp*PATH_HASH_BASE + d) & PATH_HASH_MASK,(hpp*PATH_HASH_BASE + d) & PATH_HASH_MASK)
+            self.ctx.apath_feats[key] = feats
+            return feats
+        atomics = self.ctx.atomics
+        #path_x_str=[(atomics[i]['pos'],atomics[i]['rel']) for i in path[1:-1]]
+        if end - start > 1:                
+            apath_x_str = [('X','X') for i in path[1:-1] if i not in range(start,end)]
+            apath_pos_str = [(atomics[i]['pos'],atomics[i]['rel']) for i in path[1:-1] if i not in range(start,end)]
+            apath_pos_str_pp = [(atomics[i]['pos'],atomics[i]['rel']) if not atomics[i]['isprep'] else atomics[i]['form'] for i in path[1:-1] if i not in range(start,end)]
+        else:
+            apath_x_str = [('X','X') for i in path[1:-1]]
+            apath_pos_str = [(atomics[i]['pos'],atomics[i]['rel']) for i in path[1:-1]]
+            apath_pos_str_pp = [(atomics[i]['pos'],atomics[i]['rel']) if not atomics[i]['isprep'] else atomics[i]['form'] for i in path[1:-1]]
+        apath_x_str.insert(0,atomics[path[0]]['rel'])
+        apath_x_str.append(atomics[path[-1]]['rel'])            
+
+        apath_pos_str.insert(0,atomics[path[0]]['rel'])
+        apath_pos_str.append(atomics[path[-1]]['rel'])
+
+        apath_pos_str_pp.insert(0,atomics[path[0]]['rel'])
+        apath_pos_str_pp.append(atomics[path[-1]]['rel'])            
+
+        #path_label_str = [self.ctx.sent[i]['rel'] for i in path] # dependency label
+        feats = (apath_x_str,apath_pos_str,apath_pos_str_pp,
+                 str(apath_x_str) + direction,str(apath_pos_str) + direction,str(apath_pos_str_pp) + direction)
+        self.ctx.apath_feats[key] = feats
+        return feats
+
+    @staticmethod
+    def _tag_delta(tag_to_predict,tok_form):
+        if isinstance(tag_to_predict,(ConstTag,ETag)):
+            return 'ECTag'
+        else:
+            tok_form = tok_form.lower()
+            tag_lemma = tag_to_predict.split('-')[0]
+            if tag_lemma == tok_form:
+                return '1'
+            i=0
+            slength = len(tag_lemma) if len(tag_lemma) < len(tok_form) else len(tok_form)
+            while i < slength and tag_lemma[i] == tok_form[i]:
+                i += 1
+            if i == 0:
+                return '0'
+            elif tok_form[i:]:
+                return tok_form[i:]
+            elif tag_lemma[i:]:
+                return tag_lemma[i:]
+            else:
+                assert False
+
+    def get_action_context_window(self,action,s0_atomics,b0_atomics):
+        """
+        per-action delta over the state window; s0/b0 are copied before they are written to.
+        the last value is False when the delta changed fields the state features were built on
+        """
+        atomics = self.ctx.atomics
+        shared = True
+        if not self.cidx:
+            s0_atomics = s0_atomics.copy()
+            if 'tag' in action: # next2
+                tag_to_predict = action['tag']
+                s0_atomics['eqfrmset'] = s0_atomics['frmset'] == tag_to_predict if s0_atomics['frmset'] is not NOT_ASSIGNED else NOT_ASSIGNED
+                s0_atomics['txv'] = len(tag_to_predict.split('-'))==2
+                s0_atomics['txn'] = isinstance(tag_to_predict,ETag)
+                s0_atomics['txdelta'] = GraphState._tag_delta(tag_to_predict,s0_atomics['form'])
+            else:
+                s0_atomics['txv'] = NOT_ASSIGNED
+                s0_atomics['txn'] = NOT_ASSIGNED
+                s0_atomics['txdelta'] = NOT_ASSIGNED
+                s0_atomics['eqfrmset'] = NOT_ASSIGNED
+
         if action['type'] in [REATTACH,REENTRANCE]:
             #child_to_add = action['child_to_add']
             if action['type'] == REATTACH:
@@ -471,13 +640,8 @@ class GraphState(object):
             else:
                 parent_to_attach = action['parent_to_add']
             if parent_to_attach is not None:
-                a0_atomics = GraphState.sent[parent_to_attach].copy() if isinstance(parent_to_attach,int) else ABT_TOKEN #GraphState.abt_tokens[parent_to_attach]
-                a0_brown_repr = BROWN_CLUSTER[a0_atomics['form']]
-                a0_atomics['brown4'] = a0_brown_repr[:4] if len(a0_brown_repr) > 3 else a0_brown_repr
-                a0_atomics['brown6'] = a0_brown_repr[:6] if len(a0_brown_repr) > 5 else a0_brown_repr
-                a0_atomics['brown8'] = a0_brown_repr[:8] if len(a0_brown_repr) > 7 else a0_brown_repr
-                a0_atomics['brown10'] = a0_brown_repr[:10] if len(a0_brown_repr) > 9 else a0_brown_repr
-                a0_atomics['brown20'] = a0_brown_repr[:20] if len(a0_brown_repr) > 19 else a0_brown_repr
+                b0_atomics = b0_atomics.copy()
+                a0_atomics = atomics[parent_to_attach].copy() if isinstance(parent_to_attach,int) else self.ctx.abt_atomics.copy() #GraphState.abt_tokens[parent_to_attach]
                 a0_atomics['concept'] = self.A.nodes[parent_to_attach].tag
                 aprs2,aprs1,ap1,alsb,arsb,ar2sb = self.get_node_context(parent_to_attach)
                 
@@ -493,16 +657,16 @@ class GraphState(object):
                 tr = [t for r,t in itr]
                 a0_atomics['istrace'] = parent_to_attach in tr if len(tr) > 0 else EMPTY
                 a0_atomics['rtr'] = itr[tr.index(parent_to_attach)][0] if parent_to_attach in tr else EMPTY
-                a0_atomics['hasnsubj'] = b0_atomics['rel'] in set(GraphState.sent[c]['rel'] for c in self.A.nodes[parent_to_attach].children if isinstance(c,int))
+                a0_atomics['hasnsubj'] = b0_atomics['rel'] in set(self.ctx.sent[c]['rel'] for c in self.A.nodes[parent_to_attach].children if isinstance(c,int))
                 #a0_atomics['iscycle'] = parent_to_attach in self.A.nodes[self.cidx].children or parent_to_attach in self.A.nodes[self.cidx].parents
 
                 # prop feature
                 b0_prds = None
                 b0_args = None
-                if isinstance(self.cidx,int) and GraphState.sent[self.cidx].get('pred',{}):
-                    b0_prds = GraphState.sent[self.cidx]['pred']
-                if isinstance(self.cidx,int) and GraphState.sent[self.cidx].get('args',{}):
-                    b0_args = GraphState.sent[self.cidx]['args']
+                if isinstance(self.cidx,int) and self.ctx.sent[self.cidx].get('pred',{}):
+                    b0_prds = self.ctx.sent[self.cidx]['pred']
+                if isinstance(self.cidx,int) and self.ctx.sent[self.cidx].get('args',{}):
+                    b0_args = self.ctx.sent[self.cidx]['args']
 
                 a0_atomics['isprd']=parent_to_attach in b0_prds if b0_prds else NOT_ASSIGNED
                 a0_atomics['prdlabel']=b0_prds[parent_to_attach] if a0_atomics['isprd'] else NOT_ASSIGNED
@@ -511,36 +675,11 @@ class GraphState(object):
                 a0_atomics['arglabel']=b0_args[parent_to_attach] if a0_atomics['isarg'] else NOT_ASSIGNED
                 
                 if isinstance(self.cidx,int) and isinstance(parent_to_attach,int):
-                    path,direction = GraphState.deptree.get_path(self.cidx,parent_to_attach)
-                #path_x_str=[(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
-                    if self.A.nodes[parent_to_attach].end - self.A.nodes[parent_to_attach].start > 1:                
-                        apath_x_str = [('X','X') for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
-                        apath_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
-                        apath_pos_str_pp = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form'] for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
-                    else:
-                        apath_x_str = [('X','X') for i in path[1:-1]]
-                        apath_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
-                        apath_pos_str_pp = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form'] for i in path[1:-1]]
-                    apath_x_str.insert(0,GraphState.sent[path[0]]['rel'])
-                    apath_x_str.append(GraphState.sent[path[-1]]['rel'])            
-
-                    apath_pos_str.insert(0,GraphState.sent[path[0]]['rel'])
-                    apath_pos_str.append(GraphState.sent[path[-1]]['rel'])
-
-                    apath_pos_str_pp.insert(0,GraphState.sent[path[0]]['rel'])
-                    apath_pos_str_pp.append(GraphState.sent[path[-1]]['rel'])            
-
-            #path_label_str = [GraphState.sent[i]['rel'] for i in path] # dependency label
-            #path_lemma_str.insert(0,GraphState.sent[path[0]]['rel'])
-            #path_lemma_str.append(GraphState.sent[path[-1]]['rel'])
-                    b0_atomics['apathx'] = apath_x_str
-                    b0_atomics['apathp'] = apath_pos_str
-                    b0_atomics['apathprep'] = apath_pos_str_pp
-                    b0_atomics['apathxwd'] = str(apath_x_str) + direction
-                    b0_atomics['apathpwd'] = str(apath_pos_str) + direction
-                    b0_atomics['apathprepwd'] = str(apath_pos_str_pp) + direction
+                    (b0_atomics['apathx'],b0_atomics['apathp'],b0_atomics['apathprep'],
+                     b0_atomics['apathxwd'],b0_atomics['apathpwd'],b0_atomics['apathprepwd']) = self._apath_feats(self.cidx,parent_to_attach)
             #a0_atomics['pathl'] = path_label_str
                 else:
+                    shared = False
                     b0_atomics['pathp'] = EMPTY
                     b0_atomics['pathprep'] = EMPTY
                     b0_atomics['pathpwd'] = EMPTY
@@ -568,30 +707,12 @@ class GraphState(object):
         else:
             a0_atomics = EMPTY
         '''
-            
-        if self.cidx == START_ID:
-            s0_atomics['nech'] = len(set(GraphState.sent[j]['ne'] if isinstance(j,int) else ABT_NE for j in self.A.nodes[self.idx].children) & INFER_NETAG) > 0 
-            s0_atomics['isnom'] = s0_atomics['lemma'].lower() in NOMLIST            
-            s0_atomics['concept']=self.A.nodes[self.idx].tag
-            if self.A.nodes[self.idx].children: 
-                c1 = self.A.nodes[self.idx].children[0]
-                s0_atomics['c1lemma'] = GraphState.sent[c1]['lemma'].lower() if isinstance(c1,int) else ABT_LEMMA
-                s0_atomics['c1dl'] = GraphState.sent[c1]['rel'] if isinstance(c1,int) else ABT_LEMMA
-            else:
-                s0_atomics['c1lemma'] = EMPTY
-                s0_atomics['c1dl'] = EMPTY
-        else:
-            s0_atomics['c1lemma'] = NOT_APPLY#EMPTY
-            s0_atomics['concept'] = NOT_APPLY#EMPTY
-            s0_atomics['nech'] = NOT_APPLY#EMPTY
-            s0_atomics['isnom'] = NOT_APPLY#EMPTY
-            s0_atomics['c1dl'] = NOT_APPLY#EMPTY
 
         '''
         if action['type'] == REENTRANCE and 'parent_to_add' in action: # reattach
             #child_to_add = action['child_to_add']
             parent_to_add = action['parent_to_add']
-            r0_atomics = GraphState.sent[parent_to_add]
+            r0_atomics = self.ctx.sent[parent_to_add]
             rprs2,rprs1,rp1,rlsb,rrsb,rr2sb = self.get_node_context(parent_to_add)
             r0_atomics['p1']=rp1
             r0_atomics['lsb']=rlsb
@@ -600,28 +721,28 @@ class GraphState(object):
             r0_atomics['nswp']=self.A.nodes[parent_to_add].num_swap
             r0_atomics['isne']=r0_atomics['ne'] is not 'O'
             #path,direction = self.A.get_path(self.cidx,parent_to_attach)
-            path,direction = GraphState.deptree.get_path(self.cidx,parent_to_attach)
-            #path_x_str=[(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
+            path,direction = self.ctx.deptree.get_path(self.cidx,parent_to_attach)
+            #path_x_str=[(self.ctx.sent[i]['pos'],self.ctx.sent[i]['rel']) for i in path[1:-1]]
             if self.A.nodes[parent_to_attach].end - self.A.nodes[parent_to_attach].start > 1:                
                 apath_x_str = [('X','X') for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
-                apath_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
-                apath_pos_str_pp = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form'] for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
+                apath_pos_str = [(self.ctx.sent[i]['pos'],self.ctx.sent[i]['rel']) for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
+                apath_pos_str_pp = [(self.ctx.sent[i]['pos'],self.ctx.sent[i]['rel']) if not isprep(self.ctx.sent[i]) else self.ctx.sent[i]['form'] for i in path[1:-1] if i not in range(self.A.nodes[parent_to_attach].start,self.A.nodes[parent_to_attach].end)]
             else:
                 apath_x_str = [('X','X') for i in path[1:-1]]
-                apath_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
-                apath_pos_str_pp = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) if not isprep(GraphState.sent[i]) else GraphState.sent[i]['form'] for i in path[1:-1]]
-            apath_x_str.insert(0,GraphState.sent[path[0]]['rel'])
-            apath_x_str.append(GraphState.sent[path[-1]]['rel'])            
+                apath_pos_str = [(self.ctx.sent[i]['pos'],self.ctx.sent[i]['rel']) for i in path[1:-1]]
+                apath_pos_str_pp = [(self.ctx.sent[i]['pos'],self.ctx.sent[i]['rel']) if not isprep(self.ctx.sent[i]) else self.ctx.sent[i]['form'] for i in path[1:-1]]
+            apath_x_str.insert(0,self.ctx.sent[path[0]]['rel'])
+            apath_x_str.append(self.ctx.sent[path[-1]]['rel'])            
 
-            apath_pos_str.insert(0,GraphState.sent[path[0]]['rel'])
-            apath_pos_str.append(GraphState.sent[path[-1]]['rel'])
+            apath_pos_str.insert(0,self.ctx.sent[path[0]]['rel'])
+            apath_pos_str.append(self.ctx.sent[path[-1]]['rel'])
 
-            apath_pos_str_pp.insert(0,GraphState.sent[path[0]]['rel'])
-            apath_pos_str_pp.append(GraphState.sent[path[-1]]['rel'])            
+            apath_pos_str_pp.insert(0,self.ctx.sent[path[0]]['rel'])
+            apath_pos_str_pp.append(self.ctx.sent[path[-1]]['rel'])            
 
-            #path_label_str = [GraphState.sent[i]['rel'] for i in path] # dependency label
-            #path_lemma_str.insert(0,GraphState.sent[path[0]]['rel'])
-            #path_lemma_str.append(GraphState.sent[path[-1]]['rel'])
+            #path_label_str = [self.ctx.sent[i]['rel'] for i in path] # dependency label
+            #path_lemma_str.insert(0,self.ctx.sent[path[0]]['rel'])
+            #path_lemma_str.append(self.ctx.sent[path[-1]]['rel'])
             b0_atomics['apathx'] = apath_x_str
             b0_atomics['apathp'] = apath_pos_str
             b0_atomics['apathprep'] = apath_pos_str_pp
@@ -633,16 +754,16 @@ class GraphState(object):
             a0_atomics = EMPTY
         '''
         
-        return (s0_atomics,b0_atomics,a0_atomics)
+        return (s0_atomics,b0_atomics,a0_atomics,shared)
         
     def get_gold_edge_graph(self):
         gold_edge_graph = copy.deepcopy(self.A)
         parsed_tuples = gold_edge_graph.tuples()
-        gold_tuples = self.gold_graph.tuples()
+        gold_tuples = self.ctx.gold_graph.tuples()
         
         for t_tuple in parsed_tuples:            
             if t_tuple in gold_tuples:            
-                gold_arc_label = self.gold_graph.get_edge_label(t_tuple[0],t_tuple[1])
+                gold_arc_label = self.ctx.gold_graph.get_edge_label(t_tuple[0],t_tuple[1])
                 gold_edge_graph.set_edge_label(t_tuple[0],t_tuple[1],gold_arc_label)
 
         return gold_edge_graph
@@ -650,22 +771,22 @@ class GraphState(object):
     def get_gold_tag_graph(self):
         gold_tag_graph = copy.deepcopy(self.A)
         for nid in gold_tag_graph.nodes.keys()[:]:
-            if nid in self.gold_graph.nodes:
-                gold_tag_label = self.gold_graph.get_node_tag(nid)
+            if nid in self.ctx.gold_graph.nodes:
+                gold_tag_label = self.ctx.gold_graph.get_node_tag(nid)
                 gold_tag_graph.set_node_tag(nid,gold_tag_label)
         return gold_tag_graph
 
     def get_gold_label_graph(self):
         gold_label_graph = copy.deepcopy(self.A)
         parsed_tuples = gold_label_graph.tuples()
-        gold_tuples = self.gold_graph.tuples()
+        gold_tuples = self.ctx.gold_graph.tuples()
         for t_tuple in parsed_tuples:
             if t_tuple in gold_tuples:
-                gold_arc_label = self.gold_graph.get_edge_label(t_tuple[0],t_tuple[1])
+                gold_arc_label = self.ctx.gold_graph.get_edge_label(t_tuple[0],t_tuple[1])
                 gold_label_graph.set_edge_label(t_tuple[0],t_tuple[1],gold_arc_label)
-                gold_tag_label1 = self.gold_graph.get_node_tag(t_tuple[0])
+                gold_tag_label1 = self.ctx.gold_graph.get_node_tag(t_tuple[0])
                 gold_label_graph.set_node_tag(t_tuple[0],gold_tag_label1)
-                gold_tag_label2 = self.gold_graph.get_node_tag(t_tuple[1])
+                gold_tag_label2 = self.ctx.gold_graph.get_node_tag(t_tuple[1])
                 gold_label_graph.set_node_tag(t_tuple[1],gold_tag_label2)
         return gold_label_graph
 
@@ -674,10 +795,10 @@ class GraphState(object):
         num_correct_labeled_arcs = .0
 
         parsed_tuples = self.A.tuples()
-        if self.verbose > 1:
+        if self.ctx.verbose > 1:
             print >> sys.stderr, 'Parsed tuples:'+str(parsed_tuples) 
         num_parsed_arcs = len(parsed_tuples)
-        gold_tuples = self.gold_graph.tuples()
+        gold_tuples = self.ctx.gold_graph.tuples()
         num_gold_arcs = len(gold_tuples)
 
         num_correct_tags = .0
@@ -692,8 +813,8 @@ class GraphState(object):
             if p_p not in visited_nodes:
                 visited_nodes.add(p_p)
                 p_tag = self.A.get_node_tag(p_p)
-                if p in self.gold_graph.nodes:
-                    g_p_tag = self.gold_graph.get_node_tag(p)
+                if p in self.ctx.gold_graph.nodes:
+                    g_p_tag = self.ctx.gold_graph.get_node_tag(p)
                     if p_tag == g_p_tag:# and not (isinstance(g_p_tag,(ETag,ConstTag)) or re.match('\w+-\d+',g_p_tag)): #and isinstance(g_p_tag,(ETag,ConstTag)):
                         num_correct_tags += 1.0
                     else:
@@ -705,8 +826,8 @@ class GraphState(object):
             if c_p not in visited_nodes:
                 visited_nodes.add(c_p)
                 c_tag = self.A.get_node_tag(c_p)
-                if c in self.gold_graph.nodes:
-                    g_c_tag = self.gold_graph.get_node_tag(c)
+                if c in self.ctx.gold_graph.nodes:
+                    g_c_tag = self.ctx.gold_graph.get_node_tag(c)
                     if c_tag == g_c_tag:# and not (isinstance(g_c_tag,(ETag,ConstTag)) or re.match('\w+-\d+',g_c_tag)): #and isinstance(g_c_tag,(ETag,ConstTag)):
                         num_correct_tags += 1.0
                     else:
@@ -720,7 +841,7 @@ class GraphState(object):
             if (p,c) in gold_tuples:
                 num_correct_arcs += 1.0
                 parsed_arc_label = self.A.get_edge_label(p_p,c_p)
-                gold_arc_label = self.gold_graph.get_edge_label(p,c)
+                gold_arc_label = self.ctx.gold_graph.get_edge_label(p,c)
                 if parsed_arc_label == gold_arc_label:
                     num_correct_labeled_arcs += 1.0
                 else:
@@ -729,18 +850,18 @@ class GraphState(object):
                 self.A.edges_error_table[(p_p,c_p)]=EDGE_MATCH_ERROR
                     
         #num_parsed_tags = len([i for i in visited_nodes if re.match('\w+-\d+',self.A.get_node_tag(i))])
-        #num_gold_tags = len([j for j in self.gold_graph.nodes if re.match('\w+-\d+',self.gold_graph.get_node_tag(j))])
+        #num_gold_tags = len([j for j in self.ctx.gold_graph.nodes if re.match('\w+-\d+',self.ctx.gold_graph.get_node_tag(j))])
         #num_parsed_tags = len([i for i in visited_nodes if isinstance(self.A.get_node_tag(i),(ETag,ConstTag))])
-        #num_gold_tags = len([j for j in self.gold_graph.nodes if isinstance(self.gold_graph.get_node_tag(j),(ETag,ConstTag))])
+        #num_gold_tags = len([j for j in self.ctx.gold_graph.nodes if isinstance(self.ctx.gold_graph.get_node_tag(j),(ETag,ConstTag))])
         #num_parsed_tags = len([i for i in visited_nodes if not (isinstance(self.A.get_node_tag(i),(ETag,ConstTag)) or re.match('\w+-\d+',self.A.get_node_tag(i)))])
-        #num_gold_tags = len([j for j in self.gold_graph.nodes if not (isinstance(self.gold_graph.get_node_tag(j),(ETag,ConstTag)) or re.match('\w+-\d+',self.gold_graph.get_node_tag(j)))])
+        #num_gold_tags = len([j for j in self.ctx.gold_graph.nodes if not (isinstance(self.ctx.gold_graph.get_node_tag(j),(ETag,ConstTag)) or re.match('\w+-\d+',self.ctx.gold_graph.get_node_tag(j)))])
         num_parsed_tags = len(visited_nodes)
-        num_gold_tags = len(self.gold_graph.nodes)
+        num_gold_tags = len(self.ctx.gold_graph.nodes)
         return num_correct_labeled_arcs,num_correct_arcs,num_parsed_arcs,num_gold_arcs,num_correct_tags,num_parsed_tags,num_gold_tags
     '''
     def evaluate_actions(self,gold_state):
-        gold_act_seq = gold_state.action_history
-        parsed_act_seq = self.action_history
+        gold_act_seq = gold_state.get_action_history()
+        parsed_act_seq = self.get_action_history()
         confusion_matrix = np.zeros(shape=(len(GraphState.action_table),len(GraphState.action_table)))
         edge_label_count = defaultdict(float)
         # chop out the longer one
@@ -768,8 +889,59 @@ class GraphState(object):
         feat_idx = map(GraphState.model.feature_codebook[act_idx].get_index,feature)
         return np.sum(weight[ [i for i in feat_idx if i is not None] ],axis = 0)
         
-    def make_feat(self,action):
-        feat = GraphState.model.feats_generator(self,action)
+    def get_scores(self,actions,features,train=True,state_feats=None):
+        """
+        score all the candidate actions of one step at once: for each action class
+        the feature indices are looked up in one batch, laid out as segments of one
+        flat array, gathered from the weight matrix and summed with a single
+        np.add.reduceat.
+        state_feats (make_state_feat) only matters to the feature profile, which counts
+        the shared state features once per step instead of once per candidate.
+        returns a (num_actions x max_num_labels) matrix padded with -inf
+        """
+        model = GraphState.model
+        profile = model.feature_profile
+        if profile is not None:
+            shared = frozenset(state_feats[2]) if state_feats is not None else frozenset()
+            known_shared = set([])
+        weights = model.weight if train else model.avg_weight
+        groups = defaultdict(list)
+        for i,act in enumerate(actions):
+            groups[model.class_codebook.get_index(act['type'])].append(i)
+
+        width = max(weights[act_idx].shape[1] for act_idx in groups)
+        scores = np.empty(shape=(len(actions),width),dtype=WEIGHT_DTYPE)
+        scores.fill(-np.inf)
+        for act_idx,rows in groups.iteritems():
+            weight = weights[act_idx]
+            flat = [f for i in rows for f in features[i]]
+            indices = model.feature_codebook[act_idx].get_indices(flat)
+            if profile is not None: profile.count(flat,indices,shared,known_shared)
+            segment = np.repeat(np.arange(len(rows)),[len(features[i]) for i in rows])
+            found = indices >= 0
+            indices, segment = indices[found], segment[found]
+            seg_scores = np.zeros(shape=(len(rows),weight.shape[1]),dtype=WEIGHT_DTYPE)
+            if len(indices):
+                counts = np.bincount(segment,minlength=len(rows))
+                indptr = np.concatenate(([0],np.cumsum(counts)[:-1]))
+                nonempty = counts > 0
+                seg_scores[nonempty] = np.add.reduceat(weight[indices],indptr[nonempty],axis=0)
+            scores[rows,:weight.shape[1]] = seg_scores
+        if profile is not None and shared:
+            profile.count(state_feats[2],[0 if f in known_shared else -1 for f in state_feats[2]])
+        return scores
+
+    def make_state_feat(self):
+        """features of this state that don't depend on the action, shared by make_feat"""
+        if GraphState.model.state_feats_generator is None: # generator predates the split
+            return None
+        return GraphState.model.state_feats_generator(self)
+
+    def make_feat(self,action,state_feats=None):
+        if state_feats is None:
+            feat = GraphState.model.feats_generator(self,action)
+        else:
+            feat = GraphState.model.feats_generator(self,action,state_feats)
         return feat
             
     def get_current_node(self):
@@ -781,10 +953,20 @@ class GraphState(object):
         else:
             return None
 
+    def get_action_history(self):
+        """rebuild the sequence of actions applied so far, oldest first"""
+        seq = []
+        node = self.action_history
+        while node is not None:
+            action, node = node
+            seq.append(action)
+        seq.reverse()
+        return seq
+
     def apply(self,action):
         action_type = action['type']
         other_params = dict([(k,v) for k,v in action.items() if k!='type' and v is not None])
-        self.action_history.append(action)
+        self.action_history = (action,self.action_history)
         return getattr(self,GraphState.action_table[action_type])(**other_params)
         
 
@@ -833,9 +1015,9 @@ class GraphState(object):
         #abt_atomics['id'] = abt_node_index
         #abt_atomics['form'] = ABT_FORM
         #abt_atomics['lemma'] = ABT_LEMMA
-        #abt_atomics['pos'] = GraphState.sent[newstate.idx]['pos'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['pos']
-        #abt_atomics['ne'] = GraphState.sent[newstate.idx]['ne'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['ne']
-        #abt_atomics['rel'] = GraphState.sent[newstate.idx]['rel'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['rel']
+        #abt_atomics['pos'] = self.ctx.sent[newstate.idx]['pos'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['pos']
+        #abt_atomics['ne'] = self.ctx.sent[newstate.idx]['ne'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['ne']
+        #abt_atomics['rel'] = self.ctx.sent[newstate.idx]['rel'] if isinstance(newstate.idx,int) else GraphState.abt_tokens[newstate.idx]['rel']
         #GraphState.abt_tokens[abt_node_index] = abt_atomics
         
         tmp = newstate.sigma.pop()
@@ -863,7 +1045,7 @@ class GraphState(object):
         newstate.A.remove_edge(newstate.idx,newstate.cidx)
         #catm = self.atomics[newstate.cidx]
         #cparents = sorted(newstate.A.nodes[self.cidx].parents)
-        #catm['blp1'] = GraphState.sent[cparents[0]] if cparents and cparents[0] < self.cidx else NOT_ASSIGNED
+        #catm['blp1'] = self.ctx.sent[cparents[0]] if cparents and cparents[0] < self.cidx else NOT_ASSIGNED
         newstate.beta.pop()
         newstate.cidx = newstate.beta.top() if newstate.beta else None
         #newstate.action_history.append(DELETEEDGE)
@@ -928,10 +1110,10 @@ class GraphState(object):
             newstate.A.add_edge(newstate.idx,child_to_add)
 
 
-        #hoffset,voffset = GraphState.deptree.relativePos(newstate.idx,node_to_add)
-        #atype = GraphState.deptree.relativePos2(newstate.idx,child_to_add)
-        #self.new_actions.add('add_child_('+str(hoffset)+')_('+str(voffset)+')_'+str(GraphState.sentID))
-        #self.new_actions.add('add_child_%s_%s'%(atype,str(GraphState.sentID)))
+        #hoffset,voffset = self.ctx.deptree.relativePos(newstate.idx,node_to_add)
+        #atype = self.ctx.deptree.relativePos2(newstate.idx,child_to_add)
+        #self.new_actions.add('add_child_('+str(hoffset)+')_('+str(voffset)+')_'+str(self.ctx.sentID))
+        #self.new_actions.add('add_child_%s_%s'%(atype,str(self.ctx.sentID)))
         #newstate.action_history.append(ADDCHILD)
         return newstate
 
@@ -939,19 +1121,19 @@ class GraphState(object):
     def _fix_prop_feature(self,idx,cidx):
         '''update cidx's prop feature with idx's prop feature'''
         if isinstance(idx,int) and isinstance(cidx,int):
-            ctok = GraphState.sent[cidx]
-            tok = GraphState.sent[idx]
+            ctok = self.ctx.sent[cidx]
+            tok = self.ctx.sent[idx]
             ctok['pred'] = ctok.get('pred',{})
             ctok['pred'].update(dict((k,v) for k,v in tok.get('pred',{}).items() if k!=cidx))
             for prd in tok.get('pred',{}).copy():
                 if prd != cidx:
                     try:
-                        tmp = GraphState.sent[prd]['args'].pop(idx)
-                        GraphState.sent[idx]['pred'].pop(prd)
+                        tmp = self.ctx.sent[prd]['args'].pop(idx)
+                        self.ctx.sent[idx]['pred'].pop(prd)
                     except KeyError:
                         import pdb
                         pdb.set_trace()                        
-                    GraphState.sent[prd]['args'][cidx] = tmp
+                    self.ctx.sent[prd]['args'][cidx] = tmp
                     
                         
             ctok['args'] = ctok.get('args',{})
@@ -959,12 +1141,12 @@ class GraphState(object):
             for arg in tok.get('args',{}).copy():
                 if arg != cidx:
                     try:
-                        atmp = GraphState.sent[arg]['pred'].pop(idx)
-                        GraphState.sent[idx]['args'].pop(arg)
+                        atmp = self.ctx.sent[arg]['pred'].pop(idx)
+                        self.ctx.sent[idx]['args'].pop(arg)
                     except KeyError:
                         import pdb
                         pdb.set_trace()
-                    GraphState.sent[arg]['pred'][cidx] = atmp
+                    self.ctx.sent[arg]['pred'][cidx] = atmp
                     
     def replace_head(self):
         """
@@ -1009,7 +1191,7 @@ class GraphState(object):
 
         newstate.idx = tmp1 if tmp1 < tmp2 else tmp2
         newstate.cidx = tmp2 if tmp1 < tmp2 else tmp1
-        GraphState.sent[newstate.idx]['rel'] = GraphState.sent[tmp1]['rel']
+        self.ctx.set_rel(newstate.idx,self.ctx.sent[tmp1]['rel'])
         newstate._fix_prop_feature(newstate.cidx,newstate.idx)
         #newstate.A.merge_node(newstate.idx,newstate.cidx)
         newstate.beta = Buffer(newstate.A.nodes[newstate.idx].children[:])
@@ -1019,7 +1201,7 @@ class GraphState(object):
         return newstate
 
     @staticmethod
-    def get_parsed_amr(span_graph):
+    def get_parsed_amr(span_graph,sent):
 
         def unpack_node(node,amr,variable):
             node_id = node.start
@@ -1028,7 +1210,7 @@ class GraphState(object):
             #    import pdb
             #    pdb.set_trace()
             core_var = None
-            tokens_in_span = GraphState.sent[node.start:node.end] if isinstance(node_id,int) else node.words
+            tokens_in_span = sent[node.start:node.end] if isinstance(node_id,int) else node.words
             if isinstance(node_tag,ETag):
                 # normalize country adjective
 
@@ -1248,36 +1430,36 @@ class GraphState(object):
             if self.idx == START_ID:
                 span_g = START_FORM
             else:
-                span_g = ','.join(tok['form'] for tok in GraphState.sent[self.idx:self.A.nodes[self.idx].end]) if isinstance(self.idx,int) else ','.join(self.A.nodes[self.idx].words)
+                span_g = ','.join(tok['form'] for tok in self.ctx.sent[self.idx:self.A.nodes[self.idx].end]) if isinstance(self.idx,int) else ','.join(self.A.nodes[self.idx].words)
             if self.cidx == START_ID:
                 span_d = START_FORM
             else:
-                span_d = ','.join(tok['form'] for tok in GraphState.sent[self.cidx:self.A.nodes[self.cidx].end]) if isinstance(self.cidx,int) else ','.join(self.A.nodes[self.cidx].words)
-            output += 'ID:%s %s\nParent:(%s-%s) Child:(%s-%s)'%(str(GraphState.sentID),self.text,\
+                span_d = ','.join(tok['form'] for tok in self.ctx.sent[self.cidx:self.A.nodes[self.cidx].end]) if isinstance(self.cidx,int) else ','.join(self.A.nodes[self.cidx].words)
+            output += 'ID:%s %s\nParent:(%s-%s) Child:(%s-%s)'%(str(self.ctx.sentID),self.ctx.text,\
                                                    span_g, self.idx, \
                                                    span_d, self.cidx)
         else:
             '''
-            if self.action_history and self.action_history[-1] == ADDCHILD: # add child
+            if self.action_history and self.action_history[0] == ADDCHILD: # add child
                 added_child_idx = self.A.nodes[self.idx].children[-1]
-                output += 'ID:%s %s\nParent:(%s-%s) add child:(%s-%s)'%(str(GraphState.sentID),self.text,\
-                                                           ','.join(tok['form'] for tok in GraphState.sent[self.idx:self.A.nodes[self.idx].end]), self.idx, \
-                                                    ','.join(tok['form'] for tok in GraphState.sent[added_child_idx:self.A.nodes[added_child_idx].end]), added_child_idx)
+                output += 'ID:%s %s\nParent:(%s-%s) add child:(%s-%s)'%(str(self.ctx.sentID),self.ctx.text,\
+                                                           ','.join(tok['form'] for tok in self.ctx.sent[self.idx:self.A.nodes[self.idx].end]), self.idx, \
+                                                    ','.join(tok['form'] for tok in self.ctx.sent[added_child_idx:self.A.nodes[added_child_idx].end]), added_child_idx)
             else:
             '''  
             if self.idx == START_ID:
                 span_g = START_FORM
-                output += 'ID:%s %s\nParent:(%s-%s) Children:%s'%(str(GraphState.sentID),self.text,\
+                output += 'ID:%s %s\nParent:(%s-%s) Children:%s'%(str(self.ctx.sentID),self.ctx.text,\
                                                                       span_g, self.idx, 'None')
             else:  
-                span_g = ','.join(tok['form'] for tok in GraphState.sent[self.idx:self.A.nodes[self.idx].end]) if isinstance(self.idx,int) else ','.join(self.A.nodes[self.idx].words)
-                output += 'ID:%s %s\nParent:(%s-%s) Children:%s'%(str(GraphState.sentID),self.text,\
+                span_g = ','.join(tok['form'] for tok in self.ctx.sent[self.idx:self.A.nodes[self.idx].end]) if isinstance(self.idx,int) else ','.join(self.A.nodes[self.idx].words)
+                output += 'ID:%s %s\nParent:(%s-%s) Children:%s'%(str(self.ctx.sentID),self.ctx.text,\
                                                                       span_g, self.idx, \
-                                                                      ['('+','.join(tok['form'] for tok in GraphState.sent[c:self.A.nodes[c].end])+')' if isinstance(c,int) else '('+','.join(self.A.nodes[c].words)+')' for c in self.A.nodes[self.idx].children])
+                                                                      ['('+','.join(tok['form'] for tok in self.ctx.sent[c:self.A.nodes[c].end])+')' if isinstance(c,int) else '('+','.join(self.A.nodes[c].words)+')' for c in self.A.nodes[self.idx].children])
 
         output += '\n'
         parsed_tuples = self.A.tuples()
-        ref_tuples = self.gold_graph.tuples()
+        ref_tuples = self.ctx.gold_graph.tuples()
         num_p = len(parsed_tuples)
         num_r = len(ref_tuples)
         tnum = num_r if num_r > num_p else num_p
@@ -1287,15 +1469,15 @@ class GraphState(object):
                 g,d = parsed_tuples[i]
                 gg,gd = ref_tuples[i]
                 parsed_edge_label = self.A.get_edge_label(g,d) 
-                gold_edge_label = self.gold_graph.get_edge_label(gg,gd)
-                gold_span_gg = ','.join(tok['form'] for tok in GraphState.sent[gg:self.gold_graph.nodes[gg].end]) if isinstance(gg,int) else ','.join(self.gold_graph.nodes[gg].words)
-                gold_span_gd = ','.join(tok['form'] for tok in GraphState.sent[gd:self.gold_graph.nodes[gd].end]) if isinstance(gd,int) else ','.join(self.gold_graph.nodes[gd].words)
-                parsed_span_g = ','.join(tok['form'] for tok in GraphState.sent[g:self.A.nodes[g].end]) if isinstance(g,int) else ','.join(self.A.nodes[g].words)
-                parsed_span_d = ','.join(tok['form'] for tok in GraphState.sent[d:self.A.nodes[d].end]) if isinstance(d,int) else ','.join(self.A.nodes[d].words)
+                gold_edge_label = self.ctx.gold_graph.get_edge_label(gg,gd)
+                gold_span_gg = ','.join(tok['form'] for tok in self.ctx.sent[gg:self.ctx.gold_graph.nodes[gg].end]) if isinstance(gg,int) else ','.join(self.ctx.gold_graph.nodes[gg].words)
+                gold_span_gd = ','.join(tok['form'] for tok in self.ctx.sent[gd:self.ctx.gold_graph.nodes[gd].end]) if isinstance(gd,int) else ','.join(self.ctx.gold_graph.nodes[gd].words)
+                parsed_span_g = ','.join(tok['form'] for tok in self.ctx.sent[g:self.A.nodes[g].end]) if isinstance(g,int) else ','.join(self.A.nodes[g].words)
+                parsed_span_d = ','.join(tok['form'] for tok in self.ctx.sent[d:self.A.nodes[d].end]) if isinstance(d,int) else ','.join(self.A.nodes[d].words)
                 parsed_tag_g = self.A.get_node_tag(g)
                 parsed_tag_d = self.A.get_node_tag(d)
-                gold_tag_gg = self.gold_graph.get_node_tag(gg)
-                gold_tag_gd = self.gold_graph.get_node_tag(gd)
+                gold_tag_gg = self.ctx.gold_graph.get_node_tag(gg)
+                gold_tag_gd = self.ctx.gold_graph.get_node_tag(gd)
                 parsed_tuple_str = "(%s(%s-%s:%s),(%s-%s:%s))" % (parsed_edge_label, parsed_span_g, g, parsed_tag_g, parsed_span_d, d, parsed_tag_d)
                 ref_tuple_str = "(%s(%s-%s:%s),(%s-%s:%s))" % (gold_edge_label, gold_span_gg, gg, gold_tag_gg, gold_span_gd, gd, gold_tag_gd)
                 output += strformat.format(parsed_tuple_str,ref_tuple_str)
@@ -1305,18 +1487,18 @@ class GraphState(object):
                 parsed_edge_label = self.A.get_edge_label(g,d)
                 parsed_tag_g = self.A.get_node_tag(g)
                 parsed_tag_d = self.A.get_node_tag(d)
-                parsed_span_g = ','.join(tok['form'] for tok in GraphState.sent[g:self.A.nodes[g].end]) if isinstance(g,int) else ','.join(self.A.nodes[g].words)
-                parsed_span_d = ','.join(tok['form'] for tok in GraphState.sent[d:self.A.nodes[d].end]) if isinstance(d,int) else ','.join(self.A.nodes[d].words)
+                parsed_span_g = ','.join(tok['form'] for tok in self.ctx.sent[g:self.A.nodes[g].end]) if isinstance(g,int) else ','.join(self.A.nodes[g].words)
+                parsed_span_d = ','.join(tok['form'] for tok in self.ctx.sent[d:self.A.nodes[d].end]) if isinstance(d,int) else ','.join(self.A.nodes[d].words)
                 parsed_tuple_str = "(%s(%s-%s:%s),(%s-%s:%s))" % (parsed_edge_label, parsed_span_g, g, parsed_tag_g, parsed_span_d, d, parsed_tag_d)
                 output += strformat.format(parsed_tuple_str,'*'*column_len)
                 output += '\n'
             elif i >= num_p and i < num_r:
                 gg,gd = ref_tuples[i]
-                gold_edge_label = self.gold_graph.get_edge_label(gg,gd)
-                gold_span_gg = ','.join(tok['form'] for tok in GraphState.sent[gg:self.gold_graph.nodes[gg].end]) if isinstance(gg,int) else ','.join(self.gold_graph.nodes[gg].words)
-                gold_span_gd = ','.join(tok['form'] for tok in GraphState.sent[gd:self.gold_graph.nodes[gd].end]) if isinstance(gd,int) else ','.join(self.gold_graph.nodes[gd].words)
-                gold_tag_gg = self.gold_graph.get_node_tag(gg)
-                gold_tag_gd = self.gold_graph.get_node_tag(gd)
+                gold_edge_label = self.ctx.gold_graph.get_edge_label(gg,gd)
+                gold_span_gg = ','.join(tok['form'] for tok in self.ctx.sent[gg:self.ctx.gold_graph.nodes[gg].end]) if isinstance(gg,int) else ','.join(self.ctx.gold_graph.nodes[gg].words)
+                gold_span_gd = ','.join(tok['form'] for tok in self.ctx.sent[gd:self.ctx.gold_graph.nodes[gd].end]) if isinstance(gd,int) else ','.join(self.ctx.gold_graph.nodes[gd].words)
+                gold_tag_gg = self.ctx.gold_graph.get_node_tag(gg)
+                gold_tag_gd = self.ctx.gold_graph.get_node_tag(gd)
                 ref_tuple_str = "(%s(%s-%s:%s),(%s-%s:%s))" % (gold_edge_label, gold_span_gg, gg, gold_tag_gg, gold_span_gd, gd, gold_tag_gd)
                 output += strformat.format('*'*column_len,ref_tuple_str)
                 output += '\n'
@@ -1331,9 +1513,9 @@ class GraphState(object):
         this method takes the unlabeled edges produced by the parser and
         adds them with fake amr relation which is mapped from dependency tag set        
         '''
-        CoNLLSent = GraphState.sent
+        CoNLLSent = self.ctx.sent
         parsed_tuples = self.A.tuples()
-        out.write(str(GraphState.sentID)+'\n')
+        out.write(str(self.ctx.sentID)+'\n')
         fake_amr_triples = []
         for g,d in parsed_tuples:
             gov = CoNLLSent[g]
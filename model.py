@@ -3,13 +3,14 @@
 from __future__ import absolute_import
 import bz2,contextlib
 import numpy as np
-import sys
+import sys,os
 import json
 import cPickle as pickle
 #import simplejson as json
 from constants import *
-from common.util import Alphabet,ETag,ConstTag
+from common.util import Alphabet,MappedAlphabet,HashedFeatureIndex,AtomTable,FeatureProfile,ETag,ConstTag
 import importlib
+from cStringIO import StringIO
 from collections import defaultdict
 
 
@@ -26,6 +27,20 @@ class Model():
     #feature_codebook = None
     #class_codebook = None
     #feats_generator = None 
+    feature_hash_bits = None # default for models pickled before the hashing trick
+    state_feats_generator = None # default for models pickled before the state/action split
+    atom_table = None # models pickled before integer feature ids format feature strings
+    _feats_gen_source = None # models pickled before in-memory generators import theirs from temp/
+    feature_profile = None # per template statistics when profile_features is on
+    _pruned_templates = frozenset() # template indexes left out of the generator, see prune
+    feature_id_bits = 48 # an integer feature id hashes the atoms in its low bits, the template index is above them
+    # atomics that differ between the candidate actions of one state
+    action_atomics = set(['txv','txn','txdelta','eqfrmset','apathx','apathp','apathprep','apathxwd','apathpwd','apathprepwd'])
+    # list valued atomics, interned as tuples
+    list_atomics = set(['dch','reph'])
+    path_hash = False # models pickled before path features were hashed intern them as tuples
+    brown_ids = False # and brown cluster prefixes as strings
+    portable_feature_ids = False # models pickled before hash integer feature ids with the builtin hash(), which differs between platforms
     def __init__(self,elog=sys.stdout):
         self.elog = elog
         self.weight = None
@@ -37,13 +52,20 @@ class Model():
         self._feats_templates_file = _FEATURE_TEMPLATES_FILE
         self._feature_templates_list = []
         self._feats_gen_filename = None
+        self._feats_gen_source = None
         self.feats_generator = None
+        self.state_feats_generator = None
+        self.atom_table = AtomTable()
+        self.path_hash = True # dependency path features are integers, see GraphState._path_feats
+        self.brown_ids = True # so are brown cluster prefixes, see BrownClusters
+        self.portable_feature_ids = True # feature ids don't depend on the platform, see _append_feats
         self.token_to_concept_table = defaultdict(set)
         self.pp_count_dict = defaultdict(int)
         self.total_num_words = 0
         self.token_label_set = defaultdict(set)
         self.class_codebook = None
         self.feature_codebook = None
+        self.feature_hash_bits = None # hashing trick with 2^bits weight rows per action class if set
         self.rel_codebook = Alphabet()
         self.tag_codebook = {
             'Concept':Alphabet(),
@@ -53,16 +75,23 @@ class Model():
         }
         self.abttag_count = defaultdict(int)
         
-    def setup(self,action_type,instances,parser,feature_templates_file=None):
+    def setup(self,action_type,instances,parser,feature_templates_file=None,feature_hash_bits=None):
         if feature_templates_file:
             self._feats_templates_file = feature_templates_file 
         self.class_codebook = Alphabet.from_dict(dict((i,k) for i,(k,v) in enumerate(ACTION_TYPE_TABLE[action_type])),True)
-        self.feature_codebook = dict([(i,Alphabet()) for i in self.class_codebook._index_to_label.keys()])
+        self.feature_hash_bits = feature_hash_bits
+        if feature_hash_bits:
+            self.feature_codebook = dict([(i,HashedFeatureIndex(feature_hash_bits)) for i in self.class_codebook._index_to_label.keys()])
+        else:
+            self.feature_codebook = dict([(i,Alphabet()) for i in self.class_codebook._index_to_label.keys()])
         self.read_templates()
         
         #n_rel,n_tag = self._set_rel_tag_codebooks(instances,parser)
         n_subclass = self._set_rel_tag_codebooks(instances,parser)
-        self._set_class_weight(self.class_codebook.size(),n_subclass)
+        if feature_hash_bits:
+            self._set_class_weight(self.class_codebook.size(),n_subclass,init_feature_dim=2**feature_hash_bits)
+        else:
+            self._set_class_weight(self.class_codebook.size(),n_subclass)
         self._set_statistics(instances)
         self.output_feature_generator()
 
@@ -111,10 +140,10 @@ class Model():
                     self.tag_codebook['ABTTag'].add(g_entity_tag)
                     self.abttag_count[g_entity_tag] += 1
                 '''
-                elif g in state.gold_graph.abt_node_table and isinstance(state.gold_graph.abt_node_table[g],int): # post aligned 
-                    gnode = state.A.nodes[state.gold_graph.abt_node_table[g]]
+                elif g in state.ctx.gold_graph.abt_node_table and isinstance(state.ctx.gold_graph.abt_node_table[g],int): # post aligned 
+                    gnode = state.A.nodes[state.ctx.gold_graph.abt_node_table[g]]
                     g_span_wds = [tok['lemma'] for tok in sent_tokens if tok['id'] in range(gnode.start,gnode.end)] 
-                    g_span_ne = sent_tokens[state.gold_graph.abt_node_table[g]]['ne']
+                    g_span_ne = sent_tokens[state.ctx.gold_graph.abt_node_table[g]]['ne']
                     g_entity_tag = gold_graph.get_node_tag(g)
                     if g_span_ne not in ['O','NUMBER']: # is name entity
                         self.token_to_concept_table[g_span_ne].add(g_entity_tag)
@@ -152,10 +181,10 @@ class Model():
                     self.tag_codebook['ABTTag'].add(d_entity_tag)
                     self.abttag_count[d_entity_tag] += 1
                 '''
-                elif d in state.gold_graph.abt_node_table and isinstance(state.gold_graph.abt_node_table[d],int): # post aligned 
-                    dnode = state.A.nodes[state.gold_graph.abt_node_table[d]]
+                elif d in state.ctx.gold_graph.abt_node_table and isinstance(state.ctx.gold_graph.abt_node_table[d],int): # post aligned 
+                    dnode = state.A.nodes[state.ctx.gold_graph.abt_node_table[d]]
                     d_span_wds = [tok['lemma'] for tok in sent_tokens if tok['id'] in range(dnode.start,dnode.end)] 
-                    d_span_ne = sent_tokens[state.gold_graph.abt_node_table[d]]['ne']
+                    d_span_ne = sent_tokens[state.ctx.gold_graph.abt_node_table[d]]['ne']
                     d_entity_tag = gold_graph.get_node_tag(d)
                     if d_span_ne not in ['O','NUMBER']: # is name entity
                         self.token_to_concept_table[d_span_ne].add(d_entity_tag)
@@ -231,63 +260,245 @@ class Model():
                 template = "'%s=%s' %% (%s)"%('&'.join(elements),'%s_'*len(elements),','.join(elements))
                 self._feature_templates_list.append((template,elements))
 
+    @staticmethod
+    def _is_action_element(e):
+        if e in ['tx','dist2']:
+            return True
+        sub_elements = e.split('_')
+        return sub_elements[0] == 'a0' or (len(sub_elements) == 2 and FEATS_ABBR.get(sub_elements[1]) in Model.action_atomics)
+
+    @staticmethod
+    def _element_definitions(templates,element_set=None):
+        """element values interned through the atom table A, None is 0"""
+        if element_set is None: element_set = set([])
+        definition_str = ''
+        for tid,elements in templates:
+            for e in elements: # definition
+                if e not in element_set:
+                    definition_str += Model._element_definition(e)
+                    element_set.add(e)
+                else:
+                    pass
+        #definition_str += "%seqfrmset=s0['eqfrmset']\n"%(Model.indent)
+        return definition_str
+
+    @staticmethod
+    def _element_definition(e):
+        if e == 'dist1':
+            definition_str = "%sdist1=abs(s0['id']-b0['id']) if b0 and 'id' in b0 and 'id' in s0 else EMPTY\n"%(Model.indent)
+            definition_str += "%sif dist1 > 10: dist1=10\n"%(Model.indent)
+            definition_str += "%sdist1=A[dist1]\n"%(Model.indent)
+            return definition_str
+        if e == 'dist2':
+            definition_str = "%sdist2=abs(a0['id']-b0['id']) if b0 and a0 and 'id' in b0 and 'id' in a0 else EMPTY\n"%(Model.indent)
+            definition_str += "%sif dist2 > 10: dist2=10\n"%(Model.indent)
+            definition_str += "%sdist2=A[dist2]\n"%(Model.indent)
+            return definition_str
+        sub_elements = e.split('_')
+        if len(sub_elements) == 2:
+            value = "%s['%s']" % (sub_elements[0],FEATS_ABBR[sub_elements[1]])
+            guard = sub_elements[0]
+        elif len(sub_elements) == 3:
+            value = "%s['%s']['%s']" % (sub_elements[0],FEATS_ABBR[sub_elements[1]],FEATS_ABBR[sub_elements[2]])
+            guard = "%s and %s['%s']" % (sub_elements[0],sub_elements[0],FEATS_ABBR[sub_elements[1]])
+        else:
+            return ''
+        if FEATS_ABBR[sub_elements[-1]] in Model.list_atomics:
+            value = "tuple(%s) if %s is not None else None" % (value,value)
+        return "%s%s=A[%s] if %s else 0\n" % (Model.indent,e,value,guard)
+
+    @staticmethod
+    def _profiled_feats(templates,portable=True):
+        """
+        definitions and appends template by template, the time since the previous
+        template goes to T[tid]; an atom shared by several templates is charged to the first
+        """
+        element_set = set([])
+        profiled_str = Model.indent+'_t=_clock()\n'
+        for tid,elements in templates:
+            profiled_str += Model._element_definitions([(tid,elements)],element_set)
+            profiled_str += Model._append_feats([(tid,elements)],portable)
+            profiled_str += '%s_u=_clock();T[%d]+=_u-_t;_t=_u\n' % (Model.indent,tid)
+        return profiled_str
+
+    @staticmethod
+    def _append_feats(templates,portable=True):
+        """
+        integer feature id: template index in the high bits, hash of template index and atom ids below.
+        the hash seeds with tid*FEATURE_TID_MULT and weights the i-th atom id by
+        PATH_HASH_BASE**(i+1) mod 2**31, exact integer arithmetic gives the same ids everywhere
+        (HashedFeatureIndex mixes the whole id before picking a row); not portable: builtin
+        hash() of the same tuple, as older models were trained with
+        """
+        append_feats_str = ''
+        mask = (1 << Model.feature_id_bits) - 1
+        for tid,elements in templates:
+            if portable:
+                feature_hash = '%d+%s' % (tid*FEATURE_TID_MULT,'+'.join('%s*%d' % (e,pow(PATH_HASH_BASE,i+1,1 << 31)) for i,e in enumerate(elements)))
+            else:
+                feature_hash = 'hash((%d,%s))' % (tid,','.join(elements))
+            append_feats_str += "%sif %s:feats.append((%s)&%d|%d)\n" % (Model.indent,' or '.join(elements),feature_hash,mask,tid << Model.feature_id_bits)
+        return append_feats_str
+
+    def feature_template(self,feature):
+        """template name of an integer feature id, for reading weights and statistics"""
+        return '&'.join(self._feature_templates_list[feature >> Model.feature_id_bits][1])
+
+    def grow_atoms(self,grow):
+        """atom values seen after training can't have weights, don't intern them"""
+        if self.atom_table is not None:
+            self.atom_table.growing = grow
+
     def output_feature_generator(self):
-        """based on feature autoeval method in (Huang,2010)'s parser"""
+        """
+        based on feature autoeval method in (Huang,2010)'s parser.
+        templates using only s0/b0 go to generate_state_features, evaluated once per state;
+        generate_features adds the ones that depend on the action.
+        features are integer ids instead of formatted strings, see _append_feats.
+        the source is compiled in memory and kept in the model, nothing is written to temp/
+        """
             
-        import time
-        self._feats_gen_filename = 'feats_gen_'+self._feats_templates_file.split('/')[-1].split('.')[0]#str(int(time.time()))
-        output = open('./temp/'+self._feats_gen_filename+'.py','w')
+        # the temp/feats_gen_*.py modules format strings and belong to older models
+        self._feats_gen_filename = 'feats_gen_'+self._feats_templates_file.split('/')[-1].split('.')[0]+'_ids'
+        self._feats_gen_source = self._feature_generator_source()
+        
+        print "Compiling feature generator!"
+        self._compile_feature_generator()
+
+    def _feature_generator_source(self,profile=False):
+        """profile: time each template into state.model.feature_profile, see profile_features"""
+        output = StringIO()
+
+        state_templates = []
+        action_templates = []
+        for tid,(template,elements) in enumerate(self._feature_templates_list):
+            if tid in self._pruned_templates: # keeps the index, it is part of the feature ids
+                continue
+            if any(Model._is_action_element(e) for e in elements):
+                action_templates.append((tid,elements))
+            else:
+                state_templates.append((tid,elements))
         
         output.write('#generated by model.py\n')
         output.write('from constants import *\n')
-        output.write('def generate_features(state,action):\n')
-        output.write(Model.indent+'s0,b0,a0=state.get_feature_context_window(action)\n')
+        if profile: output.write('from time import time as _clock\n')
+        output.write('def generate_state_features(state,s0=None,b0=None):\n')
+        output.write(Model.indent+'if s0 is None: s0,b0=state.get_state_context_window()\n')
+        output.write(Model.indent+'A=state.model.atom_table\n')
+        output.write(Model.indent+'feats=[]\n')
+        if profile:
+            output.write(Model.indent+'T=state.model.feature_profile.time\n')
+            output.write(Model._profiled_feats(state_templates,self.portable_feature_ids))
+        else:
+            output.write(Model._element_definitions(state_templates))
+            output.write(Model._append_feats(state_templates,self.portable_feature_ids))
+        output.write('%sreturn s0,b0,feats\n' % Model.indent)
         
-        element_set = set([])
-        definition_str = Model.indent+'feats=[]\n'
-        append_feats_str = ''
-
-        definition_str += Model.indent+"act_idx = state.model.class_codebook.get_index(action['type'])\n"
-        definition_str += Model.indent+"tx = action['tag'] if 'tag' in action else EMPTY\n"
+        output.write('def generate_features(state,action,state_feats=None):\n')
+        output.write(Model.indent+'if state_feats is None: state_feats=generate_state_features(state)\n')
+        output.write(Model.indent+'s0,b0,a0,shared=state.get_action_context_window(action,state_feats[0],state_feats[1])\n')
+        output.write(Model.indent+'feats=state_feats[2][:] if shared else generate_state_features(state,s0,b0)[2]\n')
+        output.write(Model.indent+'A=state.model.atom_table\n')
+        definition_str = Model.indent+"act_idx = state.model.class_codebook.get_index(action['type'])\n"
+        definition_str += Model.indent+"tx = A[action['tag']] if 'tag' in action else 0\n"
         #definition_str += Model.indent+"txv = len(tx.split('-'))==2 if tx is not EMPTY else EMPTY\n"
         #definition_str += Model.indent+"lx = action['edge_label'] if 'edge_label' in action else EMPTY\n"
         #definition_str += Model.indent+"print state.model.class_codebook._label_to_index\n"
-        #print self._feature_templates_list
+        output.write(definition_str)
+        if profile:
+            output.write(Model.indent+'T=state.model.feature_profile.time\n')
+            output.write(Model._profiled_feats(action_templates,self.portable_feature_ids))
+        else:
+            output.write(Model._element_definitions(action_templates))
+            output.write(Model._append_feats(action_templates,self.portable_feature_ids))
         
-        for template,elements in self._feature_templates_list:
+        output.write('%sreturn feats\n' % Model.indent)
+        source = output.getvalue()
+        output.close()
+        return source
 
-            for e in elements: # definition
-                if e not in element_set:
-                    sub_elements = e.split('_')
-                    if len(sub_elements) == 2:
-                        definition_str += "%s%s=%s['%s'] if %s else EMPTY\n" % (Model.indent,e,sub_elements[0],FEATS_ABBR[sub_elements[1]],sub_elements[0])
-                    elif len(sub_elements) == 3:
-                        definition_str += "%s%s=%s['%s']['%s'] if %s and %s['%s'] else EMPTY\n" % (Model.indent,e,sub_elements[0],FEATS_ABBR[sub_elements[1]],FEATS_ABBR[sub_elements[2]],sub_elements[0],sub_elements[0],FEATS_ABBR[sub_elements[1]])
-                    else:
-                        pass
-                    element_set.add(e)
-                else:
-                    pass
+    def profile_features(self):
+        """
+        opt-in: swap in a generator that times every template and count what the templates
+        fire and how much of it the feature codebook knows, see FeatureProfile.
+        the profiled generator isn't pickled, a saved or reloaded model is back to the plain one
+        """
+        if self._feats_gen_source is None:
+            print >> sys.stderr, "Feature generator of this model predates integer feature ids, can't profile it"
+            return
+        self.feature_profile = FeatureProfile(len(self._feature_templates_list),Model.feature_id_bits)
+        namespace = {}
+        exec compile(self._feature_generator_source(profile=True),'<%s_profile>' % self._feats_gen_filename,'exec') in namespace
+        self.feats_generator = namespace['generate_features']
+        self.state_feats_generator = namespace['generate_state_features']
 
-            
-            append_feats_str += "%sif [%s] != %s*[None]:feats.append(%s)\n" % (Model.indent,','.join(elements),len(elements),template)
-            #append_feats_str += "%sfeats.append(%s)\n" % (Model.indent,template)
-            
-        definition_str += "%sdist1=abs(s0['id']-b0['id']) if b0 and b0 is not ABT_TOKEN and s0 is not ABT_TOKEN else EMPTY\n"%(Model.indent)
-        definition_str += "%sif dist1 > 10: dist1=10\n"%(Model.indent)
-        definition_str += "%sdist2=abs(a0['id']-b0['id']) if b0 and a0 and b0 is not ABT_TOKEN and a0 is not ABT_TOKEN else EMPTY\n"%(Model.indent)
-        definition_str += "%sif dist2 > 10: dist2=10\n"%(Model.indent)
+    def _compile_feature_generator(self):
+        namespace = {}
+        exec compile(self._feats_gen_source,'<%s>' % self._feats_gen_filename,'exec') in namespace
+        self.feats_generator = namespace['generate_features']
+        self.state_feats_generator = namespace['generate_state_features']
 
-        #definition_str += "%seqfrmset=s0['eqfrmset']\n"%(Model.indent)
-        output.write(definition_str)
-        output.write(append_feats_str)
-        
-        output.write('%sreturn feats' % Model.indent)
-        output.close()
-        
-        #sys.path.append('/temp/')
-        print "Importing feature generator!"
-        self.feats_generator = importlib.import_module('temp.'+self._feats_gen_filename).generate_features
+    def prune(self,threshold):
+        """
+        drop the feature rows of avg_weight whose norm is under threshold and rebuild
+        the feature codebooks and weights densely over the rows left; templates without
+        any row left are no longer extracted. returns the indexes of the templates kept
+        """
+        if self.feature_hash_bits or not all(isinstance(c,Alphabet) for c in self.feature_codebook.values()):
+            print >> sys.stderr, "Only pickled models with a feature dictionary can be pruned"
+            return None
+        template_index = dict(('&'.join(elements),tid) for tid,(template,elements) in enumerate(self._feature_templates_list))
+        kept_templates = set([])
+        for i,codebook in self.feature_codebook.items():
+            weight = np.asarray(self.avg_weight[i])
+            norms = np.sqrt(np.square(weight[:codebook.size()]).sum(axis=1))
+            rows = np.flatnonzero(norms >= threshold)
+            pruned_codebook = Alphabet()
+            for r in rows:
+                feature = codebook.get_label(r)
+                pruned_codebook.add(feature)
+                if isinstance(feature,(int,long)):
+                    kept_templates.add(feature >> Model.feature_id_bits)
+                else: # formatted string feature of an older model
+                    kept_templates.add(template_index[feature.split('=')[0]])
+            print >> self.elog, 'action class %s: %s of %s feature rows kept' % (i,len(rows),codebook.size())
+            self.feature_codebook[i] = pruned_codebook
+            self.avg_weight[i] = weight[rows]
+        self.weight = None
+        self.aux_weight = None
+
+        self._pruned_templates = frozenset(tid for tid in xrange(len(self._feature_templates_list)) if tid not in kept_templates)
+        print >> self.elog, '%s of %s templates kept' % (len(kept_templates),len(self._feature_templates_list))
+        if self._feats_gen_source is not None:
+            self._feats_gen_source = self._feature_generator_source()
+            self._compile_feature_generator()
+        else:
+            print >> sys.stderr, "Feature generator of this model predates integer feature ids, all templates are still extracted"
+        return sorted(kept_templates)
+
+    def output_templates(self,templates_filename,tids=None):
+        """write the templates (all or tids) in the format read_templates reads"""
+        with open(templates_filename,'w') as f:
+            print >> f, '# pruned from %s' % (self._feats_templates_file)
+            for tid,(template,elements) in enumerate(self._feature_templates_list):
+                if tids is None or tid in tids:
+                    print >> f, '\t'.join(elements)
+
+    def dump_feature_profile(self,out=sys.stdout):
+        self.feature_profile.dump(['&'.join(elements) for template,elements in self._feature_templates_list],out)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._feats_gen_source is not None: # compiled functions don't pickle, the source does
+            state['feats_generator'] = None
+            state['state_feats_generator'] = None
+        state['feature_profile'] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self._feats_gen_source is not None:
+            self._compile_feature_generator()
 
     def toJSON(self):
         print 'Converting model to JSON'
@@ -320,6 +531,7 @@ class Model():
         weight = self.weight
         aux_weight = self.aux_weight
         #avg_weight = self.avg_weight
+        self.avg_weight = [np.asarray(w) for w in self.avg_weight] # materialize lazily averaged weights
 
         self.weight = None
         self.aux_weight = None
@@ -344,12 +556,67 @@ class Model():
         self.aux_weight = aux_weight
         #self.avg_weight = avg_weight
         
+    def save_model_dir(self,model_dir):
+        """
+        save the model as a directory parser processes can memory-map instead of unpickling:
+        model.pkl holds everything except the weights and feature codebooks,
+        feature_keys.<i>.npy the sorted feature hashes of action class i (see MappedAlphabet)
+        and avg_weight.<i>.npy its averaged weights in the same row order.
+        hashing-trick models have no feature_keys files
+        """
+        print >> self.elog, 'Model info:'
+        print >> self.elog,'class size: %s \nrelation size: %s \ntag size: %s'%(self.class_codebook.size(),self.rel_codebook.size(),map(lambda x:'%s->%s '%(x,self.tag_codebook[x].size()),self.tag_codebook.keys()))
+        print >> self.elog,'feature codebook size: %s' % (','.join(('%s:%s')%(i,f.size()) for i,f in self.feature_codebook.items()))
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+
+        for i,codebook in self.feature_codebook.items():
+            if isinstance(codebook,HashedFeatureIndex): # rows are addressed by hash already
+                np.save(os.path.join(model_dir,'avg_weight.%d.npy'%i),self.avg_weight[i])
+                continue
+            keys,rows = MappedAlphabet.sorted_keys(codebook)
+            if len(keys) < codebook.size():
+                print >> sys.stderr, 'Warning: %s feature hash collisions in action class %s, dropped' % (codebook.size()-len(keys),i)
+            np.save(os.path.join(model_dir,'feature_keys.%d.npy'%i),keys)
+            np.save(os.path.join(model_dir,'avg_weight.%d.npy'%i),self.avg_weight[i][rows])
+
+        saved = (self.elog,self.weight,self.aux_weight,self.avg_weight,self.feature_codebook)
+        self.elog = None
+        self.weight = None
+        self.aux_weight = None
+        self.avg_weight = None
+        self.feature_codebook = None
+        try:
+            with open(os.path.join(model_dir,'model.pkl'), 'wb') as f:
+                pickle.dump(self,f,pickle.HIGHEST_PROTOCOL)
+        finally:
+            self.elog,self.weight,self.aux_weight,self.avg_weight,self.feature_codebook = saved
+
+    @staticmethod
+    def load_model_dir(model_dir):
+        with open(os.path.join(model_dir,'model.pkl'), 'rb') as f:
+            model = pickle.load(f)
+        model.elog = sys.stdout
+        model.feature_codebook = {}
+        model.avg_weight = []
+        for i in sorted(model.class_codebook.indexes()):
+            if model.feature_hash_bits:
+                model.feature_codebook[i] = HashedFeatureIndex(model.feature_hash_bits,model.portable_feature_ids)
+            else:
+                model.feature_codebook[i] = MappedAlphabet(np.load(os.path.join(model_dir,'feature_keys.%d.npy'%i),mmap_mode='r'))
+            model.avg_weight.append(np.load(os.path.join(model_dir,'avg_weight.%d.npy'%i),mmap_mode='r'))
+        model.grow_atoms(False)
+        return model
+
     @staticmethod
     def load_model(model_filename):
+        if os.path.isdir(model_filename): # memory-mapped model directory
+            return Model.load_model_dir(model_filename)
         
         #with contextlib.closing(bz2.BZ2File(model_filename, 'rb')) as f:
         with open(model_filename, 'rb') as f:
             model = pickle.load(f)
+        model.grow_atoms(False)
         # deal with module name conflict
         #tmp = sys.path.pop(0)
         #model.avg_weight = np.load(open(model_filename+'.weight', 'rb'))
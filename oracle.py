@@ -2,6 +2,7 @@
 
 # class for different oracles
 from constants import *
+from collections import defaultdict
 import sys
 
 class Oracle():
@@ -27,10 +28,58 @@ class DynOracle(Oracle):
         pass
 
 
+class OracleIndex(object):
+    '''
+       per sentence lookups over the gold span graph for DetOracleABT:
+       gold node ids (aligned abstract nodes replaced by their index in the parsed graph)
+       counted as a multiset and kept in step with ref_graph.abt_node_table,
+       and the memoized ref_graph.isContained; the inverse of abt_node_table is
+       the parsed graph's own abt_node_table, filled in by the same INFER step
+    '''
+    def __init__(self,ref_graph):
+        self.ref_graph = ref_graph
+        self.abt_node_table = ref_graph.abt_node_table
+        self.gold_nodes = defaultdict(int)
+        self.contained = {}
+        for k in ref_graph.nodes:
+            self.gold_nodes[self.abt_node_table.get(k,k)] += 1
+
+    def is_valid(self,ref_graph):
+        return self.ref_graph is ref_graph and self.abt_node_table is ref_graph.abt_node_table
+
+    def __contains__(self,idx):
+        return idx in self.gold_nodes
+
+    def add_abt_mapping(self,key,value):
+        """ref_graph.add_abt_mapping keeping the index in step"""
+        if key in self.ref_graph.nodes:
+            old = self.abt_node_table.get(key,key)
+            self.gold_nodes[old] -= 1
+            if not self.gold_nodes[old]: del self.gold_nodes[old]
+            self.gold_nodes[value] += 1
+        self.ref_graph.add_abt_mapping(key,value)
+
+    def is_contained(self,idx):
+        if idx not in self.contained:
+            self.contained[idx] = self.ref_graph.isContained(idx)
+        return self.contained[idx]
+
+    @staticmethod
+    def current_parents(cg,cn):
+        """parents of current graph node cn with abstract nodes mapped to their gold index"""
+        return set(cg.abt_node_table[cp] if cp in cg.abt_node_table else cp for cp in cn.parents)
+
 class DetOracleABT(Oracle):
     '''
        deterministic oracle try to infer the unaligned concepts given gold span graph
     '''
+    index = None
+
+    def get_index(self,ref_graph):
+        if self.index is None or not self.index.is_valid(ref_graph):
+            self.index = OracleIndex(ref_graph)
+        return self.index
+
     def give_ref_action(self,state,ref_graph):
         currentIdx = state.idx
         currentChildIdx = state.cidx
@@ -82,7 +131,8 @@ class DetOracleABT(Oracle):
 
         currentNode = currentGraph.nodes[currentIdx] #state.get_current_node()
         currentChild = currentGraph.nodes[currentChildIdx] if currentChildIdx in currentGraph.nodes else None #state.get_current_child()
-        goldNodeSet = [ref_graph.abt_node_table[k] if k in ref_graph.abt_node_table else k for k in ref_graph.nodes] 
+        #goldNodeSet = [ref_graph.abt_node_table[k] if k in ref_graph.abt_node_table else k for k in ref_graph.nodes] 
+        goldNodeSet = self.get_index(ref_graph)
         result_act_type = None
         result_act_label = None
 
@@ -104,7 +154,7 @@ class DetOracleABT(Oracle):
                             and (len(ref_graph.nodes[abtParentIdx].children) == 1 or not isinstance(currentIdx_p,int) or ((goldNode.words[0] in NOMLIST or currentGraph.sent[currentIdx_p]['lemma'].lower() in NOMLIST) and len(goldNode.words) == 1)):
                         gold_tag = ref_graph.nodes[abtParentIdx].tag
                         abt_node_index = ABT_PREFIX+str(currentGraph.abt_node_num)
-                        ref_graph.add_abt_mapping(abtParentIdx,abt_node_index)
+                        goldNodeSet.add_abt_mapping(abtParentIdx,abt_node_index)
                         currentGraph.add_abt_mapping(abt_node_index,abtParentIdx)
                         return {'type':INFER},gold_tag
                     else: 
@@ -135,12 +185,13 @@ class DetOracleABT(Oracle):
                         #result_act_label = gold_edge
                     if currentChildIdx in goldNode.children: # correct
                         #parents_to_add = [p for p in goldChild.parents if p not in currentChild.parents and p in currentGraph.get_possible_reentrance_constrained(currentIdx_p,currentChildIdx_p)]
-                        parents_to_add = [p for p in goldChild.parents if p not in [currentGraph.abt_node_table[cp] if cp in currentGraph.abt_node_table else cp for cp in currentChild.parents]]
+                        currentParents = OracleIndex.current_parents(currentGraph,currentChild)
+                        parents_to_add = [p for p in goldChild.parents if p not in currentParents]
                         
                         if parents_to_add:
                             pta = parents_to_add[0]
                             if pta in ref_graph.abt_node_table: pta = ref_graph.abt_node_table[pta]
-                            if pta in currentGraph.get_possible_parent_unconstrained(currentIdx_p,currentChildIdx_p):
+                            if currentGraph.is_possible_parent_unconstrained(currentIdx_p,currentChildIdx_p,pta):
                                 gold_edge = ref_graph.get_edge_label(parents_to_add[0],currentChildIdx)
                                 return {'type':REENTRANCE,'parent_to_add':pta},gold_edge
                             else:
@@ -156,11 +207,12 @@ class DetOracleABT(Oracle):
                         return {'type':SWAP}, gold_edge # swap
                         #result_act_type = {'type':SWAP}                        
 
-                    parents_to_attach = [p for p in goldChild.parents if p not in [currentGraph.abt_node_table[cp] if cp in currentGraph.abt_node_table else cp for cp in currentChild.parents]]
+                    currentParents = OracleIndex.current_parents(currentGraph,currentChild)
+                    parents_to_attach = [p for p in goldChild.parents if p not in currentParents]
                     if parents_to_attach:
                         pta = parents_to_attach[0]
                         if pta in ref_graph.abt_node_table: pta = ref_graph.abt_node_table[pta]
-                        if pta in currentGraph.get_possible_parent_unconstrained(currentIdx_p,currentChildIdx_p):
+                        if currentGraph.is_possible_parent_unconstrained(currentIdx_p,currentChildIdx_p,pta):
                             gold_edge = ref_graph.get_edge_label(parents_to_attach[0],currentChildIdx)
                             return {'type':REATTACH,'parent_to_attach':pta},gold_edge
                         #elif not isinstance(pta,int): # abstract (or unaligned) nodes
@@ -210,7 +262,7 @@ class DetOracleABT(Oracle):
                 #    pass            
                 
                                     
-        elif ref_graph.isContained(currentIdx):
+        elif goldNodeSet.is_contained(currentIdx):
             if currentChildIdx:
                 if currentChildIdx in goldNodeSet:
                     #goldChild = ref_graph.nodes[currentChildIdx] if currentChildIdx in ref_graph.nodes else ref_graph.nodes[currentGraph.abt_node_table[currentChildIdx]]
@@ -221,7 +273,7 @@ class DetOracleABT(Oracle):
                     if goldChild.contains(currentNode):
                         return {'type':MERGE},None
                     else:
-                        parents_to_attach = [p for p in goldChild.parents if p not in currentChild.parents and p in currentGraph.get_possible_parent_unconstrained(currentIdx,currentChildIdx_p)]
+                        parents_to_attach = [p for p in goldChild.parents if p not in currentChild.parents and currentGraph.is_possible_parent_unconstrained(currentIdx,currentChildIdx_p,p)]
                         #parents_to_attach = [p for p in goldChild.parents if p not in currentChild.parents and p in currentGraph.get_possible_parent_unconstrained(currentIdx,currentChildIdx)]
                         if parents_to_attach:
                             if ref_graph.nodes[parents_to_attach[0]].contains(currentNode):                                
@@ -284,11 +336,12 @@ class DetOracleABT(Oracle):
                     if isCorrectReplace(currentChildIdx,currentNode,ref_graph) or len(currentNode.children) == 1: #current node's parents are already aligned
                         return {'type':REPLACEHEAD},None # replace head
                     else:
-                        parents_to_attach = [p for p in goldChild.parents if p not in [currentGraph.abt_node_table[cp] if cp in currentGraph.abt_node_table else cp for cp in currentChild.parents]]
+                        currentParents = OracleIndex.current_parents(currentGraph,currentChild)
+                        parents_to_attach = [p for p in goldChild.parents if p not in currentParents]
                         if parents_to_attach:
                             pta = parents_to_attach[0]
                             if pta in ref_graph.abt_node_table: pta = ref_graph.abt_node_table[pta]
-                            if pta in currentGraph.get_possible_parent_unconstrained(currentIdx,currentChildIdx_p):
+                            if currentGraph.is_possible_parent_unconstrained(currentIdx,currentChildIdx_p,pta):
                                 gold_edge = ref_graph.get_edge_label(parents_to_attach[0],currentChildIdx)
                                 return {'type':REATTACH,'parent_to_attach':pta},gold_edge
                             #elif not isinstance(pta,int) and pta not in currentGraph.nodes: # abstract (or unaligned) nodes
@@ -6,10 +6,13 @@
 from __future__ import absolute_import
 from common.util import *
 from constants import *
+import constants
 from graphstate import GraphState
 from newstate import Newstate
 import optparse
-import sys,copy,time,datetime
+import sys,os,copy,time,datetime,hashlib,inspect
+import multiprocessing
+from collections import deque
 import numpy as np
 from perceptron import Perceptron
 import cPickle as pickle
@@ -21,6 +24,32 @@ DRAW_GRAPH = False
 WRITE_FAKE_AMR = False
 OUTPUT_PARSED_AMR = True
 
+# set in the parent right before the worker pool forks, so that workers
+# inherit the loaded model and the instances instead of unpickling them
+_worker_parser = None
+_worker_instances = None
+
+def _parse_data(inst):
+    """worker: parse one test instance and return its AMR"""
+    step,state = _worker_parser.parse(inst,train=False)
+    if _worker_parser.verbose > 1: print >> _worker_parser.elog, "Done parsing sentence %s" % (state.ctx.sentID)
+    return GraphState.get_parsed_amr(state.A,state.ctx.sent)
+
+def _parse_instance(i):
+    """worker: parse the i-th test instance and return its AMR"""
+    return _parse_data(_worker_instances[i])
+
+def _instance_key(inst):
+    """digest of what the oracle sees of a training instance: tokens, dependency tree, traces, coreference and gold span graph"""
+    g = inst.gold_graph
+    h = hashlib.md5()
+    h.update(repr([sorted(tok.items()) for tok in inst.tokens]))
+    h.update(repr(sorted((k,sorted(v)) for k,v in inst.trace_dict.items())))
+    h.update(repr(inst.coreference))
+    h.update(repr(sorted((k,n.end,n.tag) for k,n in g.nodes.items())))
+    h.update(repr(sorted(g.edges.items())))
+    return h.digest()
+
 class Parser(object):
     """
     """
@@ -59,28 +88,29 @@ class Parser(object):
 
 
     def get_best_act(self,scores,actions):
+        '''scores is the padded (action x label) matrix from State.get_scores'''
         best_label_index = None
-        best_act_ind = np.argmax(map(np.amax,scores))
+        best_act_ind, best_col = np.unravel_index(scores.argmax(),scores.shape)
         best_act = actions[best_act_ind]
         if best_act['type'] in ACTION_WITH_EDGE or best_act['type'] in ACTION_WITH_TAG:
-            best_label_index = scores[best_act_ind].argmax()
+            best_label_index = best_col
         return best_act_ind, best_label_index
         
     def get_best_act_constraint(self,scores,actions,argset):
         best_label_index = None
-        best_act_ind = np.argmax(map(np.amax,scores))
+        best_act_ind, best_col = np.unravel_index(scores.argmax(),scores.shape)
         if actions[best_act_ind]['type'] in ACTION_WITH_EDGE:
-            best_label_index = scores[best_act_ind].argmax()
+            best_label_index = best_col
             # best label violates the constraint
             while best_label_index in argset:
-                scores[best_act_ind][best_label_index] = -float('inf')
-                best_act_ind = np.argmax(map(np.amax,scores))
+                scores[best_act_ind,best_label_index] = -float('inf')
+                best_act_ind, best_col = np.unravel_index(scores.argmax(),scores.shape)
                 if actions[best_act_ind]['type'] in ACTION_WITH_EDGE or actions[best_act_ind]['type'] in ACTION_WITH_TAG:
-                    best_label_index = scores[best_act_ind].argmax()
+                    best_label_index = best_col
                 else:
                     best_label_index = None
         elif actions[best_act_ind]['type'] in ACTION_WITH_TAG:
-            best_label_index = scores[best_act_ind].argmax()
+            best_label_index = best_col
         return best_act_ind, best_label_index
 
 
@@ -111,6 +141,7 @@ class Parser(object):
         n_correct_total = .0
         n_parsed_total = .0
         #n_gold_total = .0
+        Parser.State.model.grow_atoms(True)
         
         for i,inst in enumerate(instances,1):
             #per_start_time = time.time()
@@ -132,10 +163,11 @@ class Parser(object):
         #f = 2*p*r/(p+r)
         print >> self.elog,"Total Accuracy: %s" % (pt)
 
-    def parse_corpus_test(self, instances, EVAL=False):
+    def parse_corpus_test(self, instances, EVAL=False, workers=1):
         start_time = time.time()
         parsed_amr = []
         span_graph_pairs = []
+        Parser.State.model.grow_atoms(False)
         
         if EVAL:
             Parser.cm = np.zeros(shape=(len(GraphState.action_table),len(GraphState.action_table)))
@@ -214,9 +246,9 @@ class Parser(object):
                 ############################
 
 
-                parsed_amr.append(GraphState.get_parsed_amr(state.A))
-                span_graph_pairs.append((state.A,state.gold_graph,score))
-                print >> self.elog, "Done parsing sentence %s" % (state.sentID)
+                parsed_amr.append(GraphState.get_parsed_amr(state.A,state.ctx.sent))
+                span_graph_pairs.append((state.A,state.ctx.gold_graph,score))
+                print >> self.elog, "Done parsing sentence %s" % (state.ctx.sentID)
 
             print >> self.elog,"Parsing on %s instances takes %s" % (str(i),datetime.timedelta(seconds=round(time.time()-start_time,0)))
             p = n_correct_total/n_parsed_total if n_parsed_total != .0 else .0
@@ -254,6 +286,21 @@ class Parser(object):
             #print random.sample(brackets['60-100'],10)        
 
             #return results
+        elif workers > 1:
+            # sentences are independent at test time: fork workers sharing the
+            # model copy-on-write, results come back in input order
+            global _worker_parser, _worker_instances
+            _worker_parser, _worker_instances = self, instances
+            pool = multiprocessing.Pool(workers)
+            try:
+                chunksize = max(1,min(16,len(instances)/(workers*4)))
+                parsed_amr = pool.map(_parse_instance,xrange(len(instances)),chunksize)
+            finally:
+                pool.close()
+                pool.join()
+                _worker_parser, _worker_instances = None, None
+
+            print >> self.elog,"Parsing on %s instances with %s workers takes %s" % (str(len(instances)),workers,datetime.timedelta(seconds=round(time.time()-start_time,0)))
         else:
 
             for i,inst in enumerate(instances,1):
@@ -261,21 +308,74 @@ class Parser(object):
                 step,state = self.parse(inst,train=False)
                 per_parse_time = round(time.time()-per_start_time,3)
 
-                parsed_amr.append(GraphState.get_parsed_amr(state.A))
-                if self.verbose > 1: print >> self.elog, "Done parsing sentence %s" % (state.sentID)
+                parsed_amr.append(GraphState.get_parsed_amr(state.A,state.ctx.sent))
+                if self.verbose > 1: print >> self.elog, "Done parsing sentence %s" % (state.ctx.sentID)
                 
             print >> self.elog,"Parsing on %s instances takes %s" % (str(i),datetime.timedelta(seconds=round(time.time()-start_time,0)))
+
+        if Parser.State.model.feature_profile is not None:
+            print >> self.elog,"Feature template profile:"
+            Parser.State.model.dump_feature_profile(self.elog)
             
         return span_graph_pairs, parsed_amr
         
+    def parse_corpus_iter(self, instances, workers=1):
+        '''
+        streaming parse: consume instances lazily and yield (instance, parsed AMR)
+        pairs in input order; with workers only a few instances per worker are in flight
+        '''
+        start_time = time.time()
+        n = 0
+        Parser.State.model.grow_atoms(False)
+        if workers > 1:
+            global _worker_parser
+            _worker_parser = self
+            pool = multiprocessing.Pool(workers)
+            pending = deque()
+            try:
+                for inst in instances:
+                    pending.append((inst,pool.apply_async(_parse_data,(inst,))))
+                    if len(pending) >= workers*4:
+                        inst,result = pending.popleft()
+                        n += 1
+                        yield inst,result.get()
+                while pending:
+                    inst,result = pending.popleft()
+                    n += 1
+                    yield inst,result.get()
+            finally:
+                pool.close()
+                pool.join()
+                _worker_parser = None
+        else:
+            for inst in instances:
+                step,state = self.parse(inst,train=False)
+                if self.verbose > 1: print >> self.elog, "Done parsing sentence %s" % (state.ctx.sentID)
+                n += 1
+                yield inst,GraphState.get_parsed_amr(state.A,state.ctx.sent)
+
+        print >> self.elog,"Parsing on %s instances takes %s" % (str(n),datetime.timedelta(seconds=round(time.time()-start_time,0)))
+        if Parser.State.model.feature_profile is not None:
+            print >> self.elog,"Feature template profile:"
+            Parser.State.model.dump_feature_profile(self.elog)
+
     def _parse(self,instance):
         self.perceptron.no_update()
         return (True,Parser.State.init_state(instance,self.verbose))
     
+    @staticmethod
+    def _fresh_tokens(instance):
+        """shallow copy of instance with its own tokens, merges rewrite their rel/pred/args in place"""
+        instance = copy.copy(instance)
+        instance.tokens = copy.deepcopy(instance.tokens)
+        return instance
+
     def parse(self,instance,train=True): 
         # no beam; pseudo deterministic oracle
-        state = Parser.State.init_state(instance,self.verbose)
+        # every training iteration starts from the preprocessed tokens, as the oracle traces do
+        state = Parser.State.init_state(Parser._fresh_tokens(instance) if train else instance,self.verbose)
         ref_graph = instance.gold_graph
+        trace = iter(instance.oracle_trace) if train and getattr(instance,'oracle_trace',None) is not None else None
         step = 0
         pre_state = None
         
@@ -294,9 +394,10 @@ class Parser(object):
                 best_act = actions[0]
                 best_label = None
             else:
+                state_feats = state.make_state_feat() # s0/b0 part, shared by all candidate actions
                 if train:
-                    features = map(state.make_feat,actions)
-                    scores = map(state.get_score,(act['type'] for act in actions),features)
+                    features = [state.make_feat(act,state_feats) for act in actions]
+                    scores = state.get_scores(actions,features,state_feats=state_feats)
 
                     best_act_ind, best_label_index = self.get_best_act(scores,actions)#,argset)
                     best_act = actions[best_act_ind]
@@ -304,7 +405,14 @@ class Parser(object):
 
                     #print "Done argmax, %s"%(round(time.time()-start_time,2))
                     #gold_act = getattr(self,self.oracle_type)(state,ref_graph)
-                    gold_act, gold_label = Parser.oracle.give_ref_action(state,ref_graph)
+                    gold = None
+                    if trace is not None:
+                        gold = Parser.replay_oracle(state,ref_graph,next(trace,None),actions)
+                        if gold is None:
+                            trace = self._drop_oracle_trace(instance,step)
+                    if gold is None:
+                        gold = Parser.oracle.give_ref_action(state,ref_graph)
+                    gold_act, gold_label = gold
 
                     try:
                         gold_act_ind = actions.index(gold_act)
@@ -317,7 +425,7 @@ class Parser(object):
 
                         actions.append(gold_act)
                         gold_act_ind = len(actions)-1
-                        features.append(state.make_feat(gold_act))
+                        features.append(state.make_feat(gold_act,state_feats))
 
                     gold_label_index = Parser.get_label_index(gold_act,gold_label)
                     '''
@@ -344,8 +452,8 @@ class Parser(object):
                     #print "Done update, %s"%(round(time.time()-start_time,2))
                     #raw_input('ENTER TO CONTINUE')
                 else:
-                    features = map(state.make_feat,actions)
-                    scores = map(state.get_score,(act['type'] for act in actions),features,[train]*len(actions))
+                    features = [state.make_feat(act,state_feats) for act in actions]
+                    scores = state.get_scores(actions,features,train,state_feats)
 
                     best_act_ind, best_label_index = self.get_best_act(scores,actions)#,argset)
                     best_act = actions[best_act_ind]
@@ -399,11 +507,127 @@ class Parser(object):
             
             step += 1
 
+        if trace is not None and next(trace,None) is not None: # steps left over
+            self._drop_oracle_trace(instance,step)
+
         if self.verbose == 1:
             print >> sys.stderr, pre_state.print_config()
 
         return (step,state)
 
+    def oracle_trace(self,instance):
+        '''
+        (s0,b0,gold action items,label,aligned abstract node) at every step where parse(train=True)
+        consults the oracle; those steps follow the gold action, so the sequence
+        does not depend on the weights; like parse it runs on a copy of the tokens
+        '''
+        instance = Parser._fresh_tokens(instance)
+        state = Parser.State.init_state(instance,self.verbose)
+        ref_graph = instance.gold_graph
+        trace = []
+        while not state.is_terminal():
+            actions = state.get_possible_actions(True)
+            if len(actions) == 1:
+                act,label = actions[0],None
+            else:
+                abt_node_index = ABT_PREFIX+str(state.A.abt_node_num)
+                act,label = Parser.oracle.give_ref_action(state,ref_graph)
+                abt = state.A.abt_node_table[abt_node_index] if act['type'] == INFER else None
+                trace.append((state.idx,state.cidx,tuple(act.items()),label,abt))
+            if act['type'] in ACTION_WITH_EDGE:
+                act['edge_label'] = label
+            elif act['type'] in ACTION_WITH_TAG:
+                act['tag'] = label
+            state = state.apply(act)
+        return tuple(trace)
+
+    @staticmethod
+    def replay_oracle(state,ref_graph,gold_step,actions):
+        """
+        give_ref_action from a cached trace step, redoing the abstract node alignment of INFER;
+        None when the step doesn't belong to this state: trace used up, other s0/b0, a node
+        the graph doesn't have or an action neither possible nor permissible here
+        """
+        if gold_step is None:
+            return None
+        idx,cidx,items,label,abt = gold_step
+        gold_act = dict(items)
+        if idx != state.idx or cidx != state.cidx or not Parser._fits_state(state,gold_act,label) or \
+           not (gold_act in actions or state.is_permissible(gold_act)):
+            return None
+        if abt is not None:
+            abt_node_index = ABT_PREFIX+str(state.A.abt_node_num)
+            Parser.oracle.get_index(ref_graph).add_abt_mapping(abt,abt_node_index)
+            state.A.add_abt_mapping(abt_node_index,abt)
+        return gold_act,label
+
+    @staticmethod
+    def _fits_state(state,act,label):
+        """
+        act is a transition of the action table with its own arguments (edge_label/tag come
+        from the label), and the nodes it names are in the graph
+        """
+        if act.get('type') not in Parser.State.action_table:
+            return False
+        spec = inspect.getargspec(getattr(state,Parser.State.action_table[act['type']]))
+        given = set(act)
+        if label is not None:
+            given.add('edge_label' if act['type'] in ACTION_WITH_EDGE else 'tag' if act['type'] in ACTION_WITH_TAG else None)
+        return set(spec.args[1:len(spec.args)-len(spec.defaults or ())]) <= given and \
+               all(k in spec.args and (k not in ('parent_to_attach','parent_to_add') or v in state.A.nodes) for k,v in act.items() if k != 'type')
+
+    def _drop_oracle_trace(self,instance,step):
+        """a trace out of step with the parser state isn't replayed any more, the oracle takes over"""
+        print >> self.elog,"Oracle trace of sentence %s doesn't match the parser state at step %s, running the oracle instead" % (instance.sentID,step)
+        instance.oracle_trace = None
+        return None
+
+    def _oracle_trace_key(self):
+        """
+        traces are only valid for the same trace, oracle and transition code, action set, concept table
+        and FLAG_* settings (FLAG_COREF adds traces and coreference to the dependency graph)
+        """
+        sources = [os.path.splitext(sys.modules[m].__file__)[0]+'.py' for m in (Parser.__module__,Parser.oracle.__module__,Parser.State.__module__,'common.SpanGraph')]
+        concepts = sorted((k,sorted(v)) for k,v in Parser.State.model.token_to_concept_table.items())
+        flags = sorted((k,v) for k,v in vars(constants).items() if k.startswith('FLAG_'))
+        return (self.oracle_type,sorted(Parser.State.action_table.items()),flags,
+                tuple(resource_key(f) for f in sources),hashlib.md5(repr(concepts)).digest())
+
+    def load_oracle_traces(self,instances,trace_file):
+        '''
+        attach its oracle trace to every training instance, so that parse_corpus_train
+        replays the gold actions instead of running the oracle each iteration;
+        traces are kept in trace_file and only computed for instances not found there
+        '''
+        start_time = time.time()
+        key = self._oracle_trace_key()
+        traces = {}
+        try:
+            with open(trace_file,'rb') as f:
+                cached_key,cached_traces = pickle.load(f)
+            if cached_key == key:
+                traces = cached_traces
+        except (IOError,EOFError,ValueError,TypeError,pickle.UnpicklingError):
+            pass
+
+        n_new = 0
+        for inst in instances:
+            k = _instance_key(inst)
+            if k not in traces:
+                traces[k] = self.oracle_trace(inst)
+                n_new += 1
+            inst.oracle_trace = traces[k]
+
+        if n_new:
+            try:
+                tmp_file = '%s.%d' % (trace_file,os.getpid())
+                with open(tmp_file,'wb') as f:
+                    pickle.dump((key,traces),f,pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_file,trace_file)
+            except (IOError,OSError):
+                print >> self.elog,"Could not write oracle traces to %s" % (trace_file)
+        print >> self.elog,"Oracle traces for %s instances (%s computed) take %s" % (len(instances),n_new,datetime.timedelta(seconds=round(time.time()-start_time,0)))
+
     def parse_bs(self, instance):
         '''
         parse using beam search
@@ -435,7 +659,8 @@ class Parser(object):
         weight_sum = np.sum(weight[ [i for i in feat_idx if i is not None] ],axis = 0)
         #weight_fired = weight[[i for i in feat_idx if i is not None]]
         try:
-            print >> sys.stderr, '\n'.join('%s,%f'%(f,weight[i][label_ind]) if i is not None else '%s,%f'%(f,0.0)  for f,i in zip(feats_fired,feat_idx))
+            name = GraphState.model.feature_template if GraphState.model.atom_table is not None else str
+            print >> sys.stderr, '\n'.join('%s,%f'%(name(f),weight[i][label_ind]) if i is not None else '%s,%f'%(name(f),0.0)  for f,i in zip(feats_fired,feat_idx))
             print >> sys.stderr, 'Sum: %f \n\n'%(weight_sum[label_ind])
         except TypeError:
             import pdb
@@ -489,7 +714,7 @@ class Parser(object):
         #else:
         #    self.verbose = 0
         state = Parser.State.init_state(instance,self.verbose)
-        ref_graph = state.gold_graph
+        ref_graph = state.ctx.gold_graph
         if state.A.is_root(): # empty dependency tree
             print >> sys.stderr, "Empty sentence! "+instance.text
             state.A = copy.deepcopy(ref_graph)
@@ -497,7 +722,7 @@ class Parser(object):
         if self.verbose > 1:
             #print "Gold graph:\n"+ref_graph.print_tuples()
             if DRAW_GRAPH:
-                fname = "graph"+str(state.sentID)+"_gold"
+                fname = "graph"+str(state.ctx.sentID)+"_gold"
                 self.draw_graph(fname,ref_graph.getPGStyleGraph())
 
         while not state.is_terminal():
@@ -506,7 +731,7 @@ class Parser(object):
                 #print >> sys.stderr, state.print_config()
                 #print state.A.print_tuples()                                    
                 if DRAW_GRAPH:
-                    fname = "graph"+str(state.sentID)+"_s"+str(step)
+                    fname = "graph"+str(state.ctx.sentID)+"_s"+str(step)
                     self.draw_graph(fname,state.A.getPGStyleGraph((state.idx,state.cidx)))
             
 
@@ -523,20 +748,20 @@ class Parser(object):
                 if action['type'] in [REATTACH]:
                     node_to_add = action['parent_to_add'] if 'parent_to_add' in action else action['parent_to_attach']
                     path,_ = state.A.get_path(state.cidx,node_to_add)
-                    path_str=[(state.sent[i]['pos'],state.sent[i]['rel']) for i in path[1:-1]]
-                    path_str.insert(0,state.sent[path[0]]['rel'])
-                    path_str.append(state.sent[path[-1]]['rel'])
+                    path_str=[(state.ctx.sent[i]['pos'],state.ctx.sent[i]['rel']) for i in path[1:-1]]
+                    path_str.insert(0,state.ctx.sent[path[0]]['rel'])
+                    path_str.append(state.ctx.sent[path[-1]]['rel'])
                     print >> sys.stderr,'path for attachment', path, path_str #Parser.State.deptree.path(state.cidx),Parser.State.deptree.path(node_to_add),Parser.State.deptree.get_path(state.cidx,node_to_add)
                 if action['type'] not in [NEXT2,DELETENODE]:
-                    path,_ = GraphState.deptree.get_path(state.cidx,state.idx)
+                    path,_ = state.ctx.deptree.get_path(state.cidx,state.idx)
                     if state.A.nodes[state.idx].end - state.A.nodes[state.idx].start > 1:
-                        path_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1] if i not in range(state.A.nodes[state.idx].start,state.A.nodes[state.idx].end)]
+                        path_pos_str = [(state.ctx.sent[i]['pos'],state.ctx.sent[i]['rel']) for i in path[1:-1] if i not in range(state.A.nodes[state.idx].start,state.A.nodes[state.idx].end)]
                     else:
-                        path_pos_str = [(GraphState.sent[i]['pos'],GraphState.sent[i]['rel']) for i in path[1:-1]]
-                    path_pos_str.insert(0,GraphState.sent[path[0]]['rel'])
-                    path_pos_str.append(GraphState.sent[path[-1]]['rel'])
+                        path_pos_str = [(state.ctx.sent[i]['pos'],state.ctx.sent[i]['rel']) for i in path[1:-1]]
+                    path_pos_str.insert(0,state.ctx.sent[path[0]]['rel'])
+                    path_pos_str.append(state.ctx.sent[path[-1]]['rel'])
                     print >> sys.stderr,'path for current edge', path, path_pos_str
-                    print >> sys.stderr,'Deleted children','b0',sorted([GraphState.sent[j]['form'].lower() for j in state.A.nodes[state.cidx].del_child]),'s0',sorted([GraphState.sent[j]['form'].lower() for j in state.A.nodes[state.idx].del_child])
+                    print >> sys.stderr,'Deleted children','b0',sorted([state.ctx.sent[j]['form'].lower() for j in state.A.nodes[state.cidx].del_child]),'s0',sorted([state.ctx.sent[j]['form'].lower() for j in state.A.nodes[state.idx].del_child])
                 ''' 
             if state.is_permissible(action):
                 if action['type'] in ACTION_WITH_EDGE:
@@ -596,37 +821,37 @@ class Parser(object):
                     if label != None and label != START_EDGE:
                         edge_label = state.A.get_edge_label(state.idx,state.cidx)
                         if edge_label != label:
-                            error_stat['edge_error']['edge_label_error'][edge_label].append(state.sentID)
+                            error_stat['edge_error']['edge_label_error'][edge_label].append(state.ctx.sentID)
                 elif action['type'] == NEXT2:
                     if label != None:
                         tag = state.get_current_node().tag
                         if tag != label:
-                            error_stat['node_error']['node_tag_error'][tag].append(state.sentID)
+                            error_stat['node_error']['node_tag_error'][tag].append(state.ctx.sentID)
                 elif action['type'] == DELETENODE:
                     tag = state.get_current_node().tag
-                    error_stat['node_error']['extra_node_error'][tag].append(state.sentID)
+                    error_stat['node_error']['extra_node_error'][tag].append(state.ctx.sentID)
                 elif action['type'] == INFER:                    
-                    error_stat['node_error']['missing_node_error'][label].append(state.sentID)
+                    error_stat['node_error']['missing_node_error'][label].append(state.ctx.sentID)
                 elif action['type'] in [REATTACH,REENTRANCE]:
                     btag = state.get_current_child().tag
-                    bpos = GraphState.sent[state.cidx]['pos'] if isinstance(state.cidx,int) else btag
-                    brel = GraphState.sent[state.cidx]['rel'] if isinstance(state.cidx,int) else btag
+                    bpos = state.ctx.sent[state.cidx]['pos'] if isinstance(state.cidx,int) else btag
+                    brel = state.ctx.sent[state.cidx]['rel'] if isinstance(state.cidx,int) else btag
                     aid = action['parent_to_attach'] if action['type'] == REATTACH else action['parent_to_add']
                     atag = state.A.nodes[aid].tag
                     act_name = GraphState.action_table[action['type']]
                     if isinstance(aid,int):
-                        apos = GraphState.sent[aid]['pos'] 
-                        error_stat['edge_error'][act_name][bpos+brel+apos].append(state.sentID)
+                        apos = state.ctx.sent[aid]['pos'] 
+                        error_stat['edge_error'][act_name][bpos+brel+apos].append(state.ctx.sentID)
                     else:
                         apos = atag
-                        error_stat['edge_error'][act_name][apos].append(state.sentID)
+                        error_stat['edge_error'][act_name][apos].append(state.ctx.sentID)
                 else:
                     tag = state.get_current_node().tag
-                    pos = GraphState.sent[state.idx]['pos'] if isinstance(state.idx,int) else tag
+                    pos = state.ctx.sent[state.idx]['pos'] if isinstance(state.idx,int) else tag
                     btag = state.A.nodes[state.cidx].tag
-                    bpos = GraphState.sent[state.cidx]['pos'] if isinstance(state.cidx,int) else btag
+                    bpos = state.ctx.sent[state.cidx]['pos'] if isinstance(state.cidx,int) else btag
                     act_name = GraphState.action_table[action['type']]
-                    error_stat['edge_error'][act_name][pos+bpos].append(state.sentID)
+                    error_stat['edge_error'][act_name][pos+bpos].append(state.ctx.sentID)
                     
                 
                 if action['type'] in ACTION_WITH_EDGE:
@@ -3,6 +3,46 @@
 import numpy as np
 from constants import WEIGHT_DTYPE
 
+class LazyAveragedWeight(object):
+    """
+    averaged weight matrix of one action class, materialized row by row on demand:
+    each cached row carries the step it was averaged at and is recomputed from
+    weight and aux_weight only when read at a later step
+    """
+    def __init__(self,perceptron,act_idx):
+        self.perceptron = perceptron
+        self.act_idx = act_idx
+        ncol = perceptron.model.weight[act_idx].shape[1]
+        self._avg = np.zeros(shape=(0,ncol),dtype=WEIGHT_DTYPE)
+        self._stamp = np.zeros(shape=(0,),dtype=np.int64)
+
+    @property
+    def shape(self):
+        return self.perceptron.model.weight[self.act_idx].shape
+
+    def __getitem__(self,rows):
+        weight = self.perceptron.model.weight[self.act_idx]
+        aux_weight = self.perceptron.model.aux_weight[self.act_idx]
+        wstep = self.perceptron.wstep
+        n = self._avg.shape[0]
+        if n < weight.shape[0]:
+            avg = np.zeros(shape=weight.shape,dtype=WEIGHT_DTYPE)
+            avg[:n] = self._avg
+            stamp = np.empty(shape=(weight.shape[0],),dtype=np.int64)
+            stamp.fill(-1)
+            stamp[:n] = self._stamp
+            self._avg,self._stamp = avg,stamp
+
+        stale = np.atleast_1d(rows)
+        stale = stale[self._stamp[stale] != wstep]
+        if len(stale):
+            self._avg[stale] = weight[stale] - aux_weight[stale]/(wstep+.0)
+            self._stamp[stale] = wstep
+        return self._avg[rows]
+
+    def __array__(self,dtype=None):
+        return np.asarray(self[np.arange(self.shape[0])],dtype=dtype)
+
 class Perceptron():
     
     #model = None
@@ -21,14 +61,19 @@ class Perceptron():
     def no_update(self):
         self.wstep += 1
 
-    def reshape_weight(self,act_idx,reshape_rate=10**5):        
+    def reshape_weight(self,act_idx,min_rows=0,reshape_rate=10**5):
+        """
+        grow weight and aux_weight geometrically (by half, at least reshape_rate rows) so that
+        the copying cost is amortized; avg_weight follows lazily (see LazyAveragedWeight)
+        """
         w = self.model.weight[act_idx]
         aw = self.model.aux_weight[act_idx]
-        avgw = self.model.avg_weight[act_idx]
+        n_rows = max(min_rows,w.shape[0]+max(w.shape[0]/2,reshape_rate))
 
-        self.model.weight[act_idx] = np.vstack((w,np.zeros(shape=(reshape_rate,w.shape[1]),dtype=WEIGHT_DTYPE)))
-        self.model.aux_weight[act_idx] = np.vstack((aw,np.zeros(shape=(reshape_rate,aw.shape[1]),dtype=WEIGHT_DTYPE)))
-        self.model.avg_weight[act_idx] = np.vstack((avgw,np.zeros(shape=(reshape_rate,avgw.shape[1]),dtype=WEIGHT_DTYPE)))
+        self.model.weight[act_idx] = np.zeros(shape=(n_rows,w.shape[1]),dtype=WEIGHT_DTYPE)
+        self.model.weight[act_idx][:w.shape[0]] = w
+        self.model.aux_weight[act_idx] = np.zeros(shape=(n_rows,aw.shape[1]),dtype=WEIGHT_DTYPE)
+        self.model.aux_weight[act_idx][:aw.shape[0]] = aw
         
     def update_weight_one_step(self,act_g,feat_g,act_l_g,act_b,feat_b,act_l_b):
         self.num_updates += 1
@@ -42,15 +87,15 @@ class Perceptron():
         act_l_b = act_l_b if act_l_b else 0
         #act_t_b = act_t_b if act_t_b else 0
         
-        if self.model.weight[act_g_idx].shape[0] <= self.model.feature_codebook[act_g_idx].size()+len(feat_g):
-            self.reshape_weight(act_g_idx)
+        if not self.model.feature_hash_bits and self.model.weight[act_g_idx].shape[0] <= self.model.feature_codebook[act_g_idx].size()+len(feat_g):
+            self.reshape_weight(act_g_idx,self.model.feature_codebook[act_g_idx].size()+len(feat_g)+1)
 
         g_feats_indices = map(self.model.feature_codebook[act_g_idx].get_default_index,feat_g)
         self.model.weight[act_g_idx][g_feats_indices,act_l_g] += 1.0
         self.model.aux_weight[act_g_idx][g_feats_indices,act_l_g] += float(self.wstep)
         
-        if self.model.weight[act_b_idx].shape[0] <= self.model.feature_codebook[act_b_idx].size()+len(feat_b):
-            self.reshape_weight(act_b_idx)
+        if not self.model.feature_hash_bits and self.model.weight[act_b_idx].shape[0] <= self.model.feature_codebook[act_b_idx].size()+len(feat_b):
+            self.reshape_weight(act_b_idx,self.model.feature_codebook[act_b_idx].size()+len(feat_b)+1)
 
         b_feats_indices = map(self.model.feature_codebook[act_b_idx].get_default_index,feat_b)
         self.model.weight[act_b_idx][b_feats_indices,act_l_b] -= 1.0
@@ -59,13 +104,17 @@ class Perceptron():
         self.wstep += 1
         
     def average_weight(self):
+        """
+        no dense pass over the matrices: avg_weight rows are averaged when they
+        are read, so evaluating on dev only touches the rows its features fire
+        """
         for i in self.model.class_codebook.indexes():
-            weight = self.model.weight[i]
-            aux_weight = self.model.aux_weight[i]
-            avg_weight = self.model.avg_weight[i]
-            wstep = self.wstep 
-            
-            #np.divide(aux_weight,wstep+.0,aux_weight)
-            np.divide(aux_weight,wstep+.0,avg_weight)
-            np.subtract(weight,avg_weight,avg_weight)
+            if not isinstance(self.model.avg_weight[i],LazyAveragedWeight):
+                self.model.avg_weight[i] = LazyAveragedWeight(self,i)
+            #weight = self.model.weight[i]
+            #aux_weight = self.model.aux_weight[i]
+            #avg_weight = self.model.avg_weight[i]
+            #wstep = self.wstep 
+            #np.divide(aux_weight,wstep+.0,avg_weight)
+            #np.subtract(weight,avg_weight,avg_weight)
         
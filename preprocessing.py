@@ -1,5 +1,6 @@
 #!/usr/bin/python
 import sys,argparse,re,os
+import itertools
 from stanfordnlp.corenlp import *
 from common.AMRGraph import *
 from pprint import pprint
@@ -214,80 +215,81 @@ def _substitute_rne(instances, rne_filename):
         assert rne_lines.next().strip() == ''
                     
 def _add_dependency(instances,result,FORMAT="stanford"):
+    if FORMAT not in ["stanford","clear","turbo","mate","stanfordConvert","stdconv+charniak"]:
+        raise ValueError("Unknown dependency format!")
+    i = 0
+    for line in result.split('\n'):
+        if line.strip():
+            _add_dependency_line(instances[i],line,FORMAT)
+        else:
+            i += 1
+
+def _add_dependency_line(instance,line,FORMAT="stanford"):
+    """add one (non-empty) line of dependency parser output to its sentence instance"""
     if FORMAT=="stanford":
-        i = 0
-        for line in result.split('\n'):
-            if line.strip():
-                split_entry = re.split("\(|, ", line[:-1])
-                
-                if len(split_entry) == 3:
-                    rel, l_lemma, r_lemma = split_entry
-                    m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', l_lemma)
-                    l_lemma, l_index = m.group('lemma'), m.group('index')
-                    m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', r_lemma)
-                    r_lemma, r_index = m.group('lemma'), m.group('index')
-                    
-                    instances[i].addDependency( rel, l_index, r_index )
+        split_entry = re.split("\(|, ", line[:-1])
+        
+        if len(split_entry) == 3:
+            rel, l_lemma, r_lemma = split_entry
+            m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', l_lemma)
+            l_lemma, l_index = m.group('lemma'), m.group('index')
+            m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', r_lemma)
+            r_lemma, r_index = m.group('lemma'), m.group('index')
+            
+            instance.addDependency( rel, l_index, r_index )
                 
-            else:
-                i += 1
     elif FORMAT == "clear":
-        i = 0
-        for line in result.split('\n'):
-            if line.strip():
-                line = line.split()
-                instances[i].addDependency( line[6], line[5], line[0])
-            else:
-                i += 1
+        line = line.split()
+        instance.addDependency( line[6], line[5], line[0])
     elif FORMAT == "turbo":
-        i = 0
-        for line in result.split('\n'):
-            if line.strip():
-                line = line.split()
-                instances[i].addDependency( line[7], line[6], line[0])
-            else:
-                i += 1
+        line = line.split()
+        instance.addDependency( line[7], line[6], line[0])
     elif FORMAT == "mate":
-        i = 0
-        for line in result.split('\n'):
-            if line.strip():
-                line = line.split()
-                instances[i].addDependency( line[11], line[9], line[0])
-            else:
-                i += 1
+        line = line.split()
+        instance.addDependency( line[11], line[9], line[0])
     elif FORMAT in ["stanfordConvert","stdconv+charniak"]:
-        i = 0
-        for line in result.split('\n'):
-            if line.strip():
-                split_entry = re.split("\(|, ", line[:-1])
-                
-                if len(split_entry) == 3:
-                    rel, l_lemma, r_lemma = split_entry
-                    m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', l_lemma)
-                    l_lemma, l_index = m.group('lemma'), m.group('index')
-                    # some string may start with @; change the segmenter
-                    m = re.match(r'(?P<lemma>[^\^]+|\^*(?=-))(\^(?P<trace>[^-]+))?-(?P<index>[^-]+)', r_lemma)
-                    try:
-                        r_lemma,r_trace, r_index = m.group('lemma'), m.group('trace'), m.group('index')
-                    except AttributeError:
-                        import pdb
-                        pdb.set_trace()
-
-                    if r_index != 'null':
-                        # print >> sys.stderr, line
-                        try:
-                            instances[i].addDependency( rel, l_index, r_index )
-                        except IndexError:
-                            import pdb
-                            pdb.set_trace()
-                    if r_trace is not None:
-                        instances[i].addTrace( rel, l_index, r_trace )                      
-                
-            else:
-                i += 1
+        split_entry = re.split("\(|, ", line[:-1])
+        
+        if len(split_entry) == 3:
+            rel, l_lemma, r_lemma = split_entry
+            m = re.match(r'(?P<lemma>.+)-(?P<index>[^-]+)', l_lemma)
+            l_lemma, l_index = m.group('lemma'), m.group('index')
+            # some string may start with @; change the segmenter
+            m = re.match(r'(?P<lemma>[^\^]+|\^*(?=-))(\^(?P<trace>[^-]+))?-(?P<index>[^-]+)', r_lemma)
+            try:
+                r_lemma,r_trace, r_index = m.group('lemma'), m.group('trace'), m.group('index')
+            except AttributeError:
+                import pdb
+                pdb.set_trace()
+
+            if r_index != 'null':
+                # print >> sys.stderr, line
+                try:
+                    instance.addDependency( rel, l_index, r_index )
+                except IndexError:
+                    import pdb
+                    pdb.set_trace()
+            if r_trace is not None:
+                instance.addTrace( rel, l_index, r_trace )                      
     else:
         raise ValueError("Unknown dependency format!")
 
+def _iter_dependency(dep_file):
+    """
+    yield the lines of dependency parser output sentence by sentence;
+    as in _add_dependency every empty line ends a sentence
+    """
+    block = []
+    for line in dep_file:
+        line = line.rstrip('\n')
+        if line.strip():
+            block.append(line)
+        else:
+            yield block
+            block = []
+    if block:
+        yield block
+
 def load_xml_instances(input_xml):
     tree = ET.parse(input_xml)
     root = tree.getroot()
@@ -562,6 +564,68 @@ def preprocess(input_file,START_SNLP=True,INPUT_AMR='amr',PRP_FORMAT='plain'):
 
         
     return instances
+
+def _dependency_filename(tok_sent_filename):
+    """cached dependency parse of the tokenized sentence file, as read by preprocess"""
+    if constants.FLAG_DEPPARSER == "stanford":
+        return tok_sent_filename+'.stanford.dep'
+    elif constants.FLAG_DEPPARSER == "stanfordConvert":
+        return tok_sent_filename+'.stanford.parse.dep'
+    elif constants.FLAG_DEPPARSER == "stdconv+charniak":
+        if constants.FLAG_ONTO == 'onto':
+            return tok_sent_filename+'.charniak.onto.parse.dep'
+        elif constants.FLAG_ONTO == 'onto+bolt':
+            return tok_sent_filename+'.charniak.onto+bolt.parse.dep'
+        else:
+            return tok_sent_filename+'.charniak.parse.dep'
+    elif constants.FLAG_DEPPARSER in ["clear","turbo","mate"]:
+        return tok_sent_filename+'.'+constants.FLAG_DEPPARSER+'.dep'
+    else:
+        raise Exception('Unknown dependency parse type %s' % (constants.FLAG_DEPPARSER))
+
+def preprocess_iter(input_file,START_SNLP=True,INPUT_AMR='sent',PRP_FORMAT='plain'):
+    '''
+    streaming version of preprocess for raw sentence input: yields the instances one
+    by one while reading the preprocessed and dependency files incrementally, so
+    memory doesn't grow with the corpus. Falls back to preprocess when the whole
+    corpus is needed anyway (AMR input, xml format, SRL or rich name entity, missing caches)
+    '''
+    tmp_sent_filename = input_file
+    tmp_prp_filename = tmp_sent_filename+'.prp'
+    tok_sent_filename = tmp_sent_filename+'.tok'
+    if INPUT_AMR != 'sent' or PRP_FORMAT != 'plain' or constants.FLAG_PROP or constants.FLAG_RNE \
+       or not os.path.exists(tmp_prp_filename):
+        for inst in preprocess(input_file,START_SNLP=START_SNLP,INPUT_AMR=INPUT_AMR,PRP_FORMAT=PRP_FORMAT):
+            yield inst
+        return
+
+    proc1 = StanfordCoreNLP()
+    print >> log, 'Read token,lemma,name entity file %s...' % (tmp_prp_filename)
+    if not os.path.exists(tok_sent_filename): # write tokenized sentence file
+        _write_tok_sentences(tok_sent_filename,proc1.iter_parse(tmp_sent_filename))
+        proc1 = StanfordCoreNLP() # restart sentence numbering for the second pass
+
+    dep_filename = _dependency_filename(tok_sent_filename)
+    if not os.path.exists(dep_filename):
+        if constants.FLAG_DEPPARSER == "stdconv+charniak":
+            dparser = CharniakParser()
+            dparser.parse(tok_sent_filename)
+        else:
+            for inst in preprocess(input_file,START_SNLP=START_SNLP,INPUT_AMR=INPUT_AMR,PRP_FORMAT=PRP_FORMAT):
+                yield inst
+            return
+
+    print 'Read dependency file %s...' % (dep_filename)
+    if constants.FLAG_DEPPARSER in ["stanford","stanfordConvert","stdconv+charniak"]:
+        dep_file = codecs.open(dep_filename,'r',encoding='utf-8')
+    else:
+        dep_file = open(dep_filename,'r')
+    with dep_file:
+        for inst,dep_lines in itertools.izip(proc1.iter_parse(tmp_sent_filename),_iter_dependency(dep_file)):
+            for line in dep_lines:
+                _add_dependency_line(inst,line,constants.FLAG_DEPPARSER)
+            yield inst
+
 '''
 def _init_instances(sent_file,amr_strings,comments):
     print >> log, "Preprocess 1:pos, ner and dependency using stanford parser..."
@@ -529,6 +529,41 @@ class StanfordCoreNLP(object):
          '''   
         return instances
 
+    def iter_parse(self, sent_filename, chunk_size=1<<20):
+        """
+        Same as parse, but reads the preprocessed file incrementally and
+        yields the data instances one by one instead of returning a list.
+        """
+        prp_filename = sent_filename+'.prp' # preprocessed file
+        if not os.path.exists(prp_filename):
+            for data in self.parse(sent_filename):
+                yield data
+            return
+
+        separator = '-'*40
+        with open(prp_filename,'r') as prp_file:
+            buf = ''
+            i = -1 # the text before the first separator is not a result
+            while True:
+                chunk = prp_file.read(chunk_size)
+                results = (buf+chunk).split(separator)
+                # the last piece may continue in the next chunk
+                buf = results.pop() if chunk else ''
+                for result in results:
+                    if i >= 0:
+                        try:
+                            data = parse_parser_results_new(result)
+                        except Exception, e:
+                            if VERBOSE: print traceback.format_exc()
+                            raise e
+                        if isinstance(data, list):
+                            for d in data: yield d
+                        else:
+                            yield data
+                    i += 1
+                if not chunk:
+                    break
+
 
 if __name__ == '__main__':
     """